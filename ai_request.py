@@ -1,63 +1,203 @@
-import requests
+import asyncio
+import functools
 import json
-from dotenv import load_dotenv
 import os
 
+import httpx
+from dotenv import load_dotenv
+
+from moderation_batcher import MODERATION_BATCH_ENABLED, ModerationBatcher
+from moderation_cache import moderation_cache
+from prefilter import PREFILTER_ENABLED, PREFILTER_LEARN_FROM_AI, prefilter
+from resilience import CircuitOpenError, upstreams
+
 load_dotenv()
 
-def process_text_with_ai(text: str) -> dict:
+AI_SERVER_URL = os.getenv("AI_SERVER_URL")
+AI_HTTP_TIMEOUT = float(os.getenv("AI_HTTP_TIMEOUT", "10"))
+AI_HTTP_CONNECT_TIMEOUT = float(os.getenv("AI_HTTP_CONNECT_TIMEOUT", "3"))
+AI_HTTP_MAX_CONNECTIONS = int(os.getenv("AI_HTTP_MAX_CONNECTIONS", "100"))
+AI_HTTP_MAX_KEEPALIVE = int(os.getenv("AI_HTTP_MAX_KEEPALIVE", "20"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "64"))
+
+# 모든 AI 업스트림 호출이 공유하는 keep-alive 커넥션 풀
+_client: httpx.AsyncClient | None = None
+_semaphore: asyncio.Semaphore | None = None
+_in_flight = 0
+
+
+def get_client() -> httpx.AsyncClient:
     """
-    AI 서버에 텍스트를 보내 유해성 판단 및 순화된 텍스트를 요청합니다.
+    AI 서버 호출용 공유 AsyncClient를 반환합니다. (없으면 생성)
     """
-    try:
-        ai_server_url = f"{os.getenv("AI_SERVER_URL")}/process_text"
-        payload = {"text": text}
-        response = requests.post(ai_server_url, json=payload, timeout=10)
-        response.raise_for_status()
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(AI_HTTP_TIMEOUT, connect=AI_HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=AI_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=AI_HTTP_MAX_KEEPALIVE,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    """
+    공유 클라이언트의 커넥션 풀을 닫습니다. 앱 종료 시 호출합니다.
+    """
+    global _client, _semaphore
+    await moderation_batcher.close()
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _semaphore = None
 
-        ai_response = response.json()
-        original_text = ai_response.get("original_text", "")
-        processed_text = ai_response.get("processed_text", "")
 
-        is_harmful = original_text != processed_text
-        purified_text = original_text
-        harmful_words = []
-        quiz_data = None
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+    return _semaphore
 
-        if is_harmful:
+
+async def post_json(url: str, payload: dict, headers: dict | None = None, timeout: float | None = None,
+                    upstream: str | None = None) -> dict:
+    """
+    공유 클라이언트로 JSON POST 요청을 보내고 응답 JSON을 반환합니다.
+    동시 요청 수는 AI_MAX_CONCURRENCY로 제한되며, 실패 시 httpx.HTTPError를 던집니다.
+    upstream을 주면 해당 업스트림의 서킷 브레이커/적응형 타임아웃/헤지를 거칩니다. (timeout은 상한)
+    """
+    ceiling = timeout if timeout is not None else AI_HTTP_TIMEOUT
+
+    async def send(request_timeout: float, on_acquired=None) -> dict:
+        global _in_flight
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + request_timeout
+        semaphore = _get_semaphore()
+        # 동시 요청 슬롯을 기다리는 시간도 request_timeout 안에 포함됩니다.
+        try:
+            await asyncio.wait_for(semaphore.acquire(), request_timeout)
+        except asyncio.TimeoutError:
+            raise httpx.PoolTimeout(f"No AI request slot free within {request_timeout:.2f}s")
+        try:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise httpx.PoolTimeout(f"No AI request slot free within {request_timeout:.2f}s")
+            if on_acquired is not None:
+                on_acquired()
+            _in_flight += 1
             try:
-                # processed_text가 JSON 문자열일 경우 파싱
-                parsed_processed_text = json.loads(processed_text)
-                purified_text = parsed_processed_text.get("대체 문장", original_text)
-                harmful_words = parsed_processed_text.get("문장중 유해한 단어들", [])
-            except json.JSONDecodeError:
-                # processed_text가 단순 문자열일 경우 (순화된 문장 자체)
-                purified_text = processed_text
-
-        return {
-            "is_harmful": is_harmful,
-            "purified_text": purified_text,
-            "harmful_words": harmful_words,
-            "raw_processed_text_from_ai_server": processed_text, # Add this line
-            "quiz_results": ai_response.get("quiz_results", []),
-            "report_results": ai_response.get("report_results", {})
-        }
-
-    except requests.exceptions.RequestException as e:
+                # 남은 시간이 응답 전체를 기다리는 최대 시간입니다.
+                response = await asyncio.wait_for(
+                    get_client().post(
+                        url, json=payload, headers=headers,
+                        timeout=httpx.Timeout(remaining, connect=min(AI_HTTP_CONNECT_TIMEOUT, remaining)),
+                    ),
+                    remaining,
+                )
+            except asyncio.TimeoutError:
+                raise httpx.ReadTimeout(f"No response from {url} within {request_timeout:.2f}s")
+            finally:
+                _in_flight -= 1
+        finally:
+            semaphore.release()
+        response.raise_for_status()
+        return response.json()
+
+    if upstream is None:
+        return await send(ceiling)
+    return await upstreams[upstream].call(send, ceiling)
+
+
+def stats() -> dict:
+    return {
+        "max_concurrency": AI_MAX_CONCURRENCY,
+        "in_flight": _in_flight,
+        "max_connections": AI_HTTP_MAX_CONNECTIONS,
+    }
+
+
+moderation_batcher = ModerationBatcher(functools.partial(post_json, upstream="moderation"), AI_SERVER_URL)
+
+
+def parse_moderation_response(ai_response: dict) -> dict:
+    """
+    /process_text 응답을 채팅 처리에 쓰는 판단 결과 형태로 변환합니다.
+    """
+    original_text = ai_response.get("original_text", "")
+    processed_text = ai_response.get("processed_text", "")
+
+    is_harmful = original_text != processed_text
+    purified_text = original_text
+    harmful_words = []
+
+    if is_harmful:
+        try:
+            # processed_text가 JSON 문자열일 경우 파싱
+            parsed_processed_text = json.loads(processed_text)
+            purified_text = parsed_processed_text.get("대체 문장", original_text)
+            harmful_words = parsed_processed_text.get("문장중 유해한 단어들", [])
+        except json.JSONDecodeError:
+            # processed_text가 단순 문자열일 경우 (순화된 문장 자체)
+            purified_text = processed_text
+
+    return {
+        "is_harmful": is_harmful,
+        "purified_text": purified_text,
+        "harmful_words": harmful_words,
+        "raw_processed_text_from_ai_server": processed_text,
+        "quiz_results": ai_response.get("quiz_results", []),
+        "report_results": ai_response.get("report_results", {})
+    }
+
+
+def clean_result(text: str) -> dict:
+    """
+    AI 서버를 사용할 수 없을 때의 기본값 (유해하지 않은 것으로 간주).
+    """
+    return {
+        "is_harmful": False,
+        "purified_text": text,
+        "harmful_words": [],
+        "quiz_results": [],
+        "report_results": {}
+    }
+
+
+async def process_text_with_ai(text: str) -> dict:
+    """
+    AI 서버에 텍스트를 보내 유해성 판단 및 순화된 텍스트를 요청합니다.
+    로컬 prefilter가 확정할 수 있거나 moderation_cache에 있는 문장은 AI 서버를 거치지 않습니다.
+    """
+    if PREFILTER_ENABLED:
+        local_result = prefilter.classify(text)
+        if local_result is not None:
+            return local_result
+
+    cached = await moderation_cache.get(text)
+    if cached is not None:
+        return cached
+
+    try:
+        if MODERATION_BATCH_ENABLED:
+            ai_response = await moderation_batcher.submit(text)
+        else:
+            ai_server_url = f"{AI_SERVER_URL}/process_text"
+            ai_response = await post_json(ai_server_url, {"text": text}, upstream="moderation")
+        result = parse_moderation_response(ai_response)
+    except CircuitOpenError:
+        # AI 서버 장애 중에는 기다리지 않고 바로 기본값을 씁니다.
+        return clean_result(text)
+    except httpx.HTTPError as e:
         print(f"AI server connection error: {e}")
-        return {
-            "is_harmful": False,
-            "purified_text": text,
-            "harmful_words": [],
-            "quiz_results": [],
-            "report_results": {}
-        }
+        return clean_result(text)
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
-        return {
-            "is_harmful": False,
-            "purified_text": text,
-            "harmful_words": [],
-            "quiz_results": [],
-            "report_results": {}
-        }
\ No newline at end of file
+        return clean_result(text)
+
+    # 실패 시의 기본값은 캐시하지 않습니다.
+    await moderation_cache.set(text, result)
+    if PREFILTER_LEARN_FROM_AI and result["is_harmful"]:
+        prefilter.learn(result["harmful_words"])
+    return result
@@ -0,0 +1,239 @@
+"""
+오래된 메시지 보관(archive) 계층.
+
+MESSAGE_RETENTION_DAYS보다 오래된 메시지를 방/월별 gzip JSONL 세그먼트 파일로 옮기고 messages 테이블에서 지웁니다.
+세그먼트는 한 번 쓰면 바꾸지 않으며(append-only), archive_segments 테이블이 방별 id 구간으로 색인합니다.
+메시지 조회(get_messages)는 최근 기록(messages 테이블)이 모자라면 같은 커서로 세그먼트를 이어서 읽습니다.
+
+정기 실행은 앱이 백그라운드로 하거나(MESSAGE_RETENTION_DAYS > 0), cron 등으로 직접 실행합니다.
+
+    python archive.py --days 90
+"""
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+import crud
+import models
+import schemas
+from database import SessionLocal, engine
+
+# 0이면 보관하지 않습니다.
+MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", "0"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# 한 번에 옮길 메시지 수. 방/월마다 이 배치 단위로 세그먼트가 하나씩 생깁니다.
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "10000"))
+# 압축을 풀어 메모리에 들고 있을 세그먼트 수
+ARCHIVE_CACHE_SEGMENTS = int(os.getenv("ARCHIVE_CACHE_SEGMENTS", "16"))
+# 페이지 하나를 채우려고 한 번에 살펴볼 최대 세그먼트 수
+ARCHIVE_MAX_SEGMENTS_PER_PAGE = 8
+
+
+class _SegmentCache:
+    """
+    압축을 푼 세그먼트(메시지 dict 목록)의 LRU. 스레드에서 읽으므로 락으로 보호합니다.
+    """
+
+    def __init__(self, max_segments: int = ARCHIVE_CACHE_SEGMENTS):
+        self.max_segments = max_segments
+        self._segments: OrderedDict[str, list[dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, directory: str, path: str) -> list[dict]:
+        with self._lock:
+            messages = self._segments.get(path)
+            if messages is not None:
+                self._segments.move_to_end(path)
+                self.hits += 1
+                return messages
+            self.misses += 1
+        with gzip.open(os.path.join(directory, path), "rt", encoding="utf-8") as f:
+            messages = [json.loads(line) for line in f if line.strip()]
+        with self._lock:
+            self._segments[path] = messages
+            while len(self._segments) > self.max_segments:
+                self._segments.popitem(last=False)
+        return messages
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+
+_segment_cache = _SegmentCache()
+
+
+def _read_segments(directory: str, paths: list[str], before_id: int | None, after_id: int | None) -> list[dict]:
+    messages = []
+    for path in paths:
+        for message in _segment_cache.load(directory, path):
+            if before_id is not None and message["id"] >= before_id:
+                continue
+            if after_id is not None and message["id"] <= after_id:
+                continue
+            messages.append(message)
+    return messages
+
+
+async def get_messages(db, room_id: int, before_id: int | None = None, after_id: int | None = None,
+                       limit: int = 100, directory: str = ARCHIVE_DIR) -> list[schemas.Message]:
+    """
+    crud.get_messages와 같은 페이지를 돌려주되, 최근 기록으로 모자라면 보관된 세그먼트에서 이어 채웁니다.
+    """
+    hot = [
+        schemas.Message.from_orm(message)
+        for message in await db.run_sync(
+            crud.get_messages, room_id=room_id, before_id=before_id, after_id=after_id, limit=limit
+        )
+    ]
+    # 보관된 메시지는 항상 최근 기록보다 오래되었으므로, 이전 페이지가 다 차면 세그먼트를 볼 필요가 없습니다.
+    if after_id is None and len(hot) >= limit:
+        return hot
+    # 조용한 방은 세그먼트가 작으므로, 페이지가 찰 때까지 커서를 옮겨 가며 다음 세그먼트들을 읽습니다.
+    archived_by_id = {}
+    segment_before, segment_after = before_id, after_id
+    needed = limit if after_id is not None else limit - len(hot)
+    while len(archived_by_id) < needed:
+        segments = await db.run_sync(
+            crud.get_archive_segments, room_id=room_id, before_id=segment_before, after_id=segment_after,
+            limit=ARCHIVE_MAX_SEGMENTS_PER_PAGE,
+        )
+        if not segments:
+            break
+        archived = await asyncio.to_thread(
+            _read_segments, directory, [segment.path for segment in segments], before_id, after_id
+        )
+        archived_by_id.update((message["id"], message) for message in archived)
+        if after_id is not None:
+            segment_after = max(segment.last_id for segment in segments)
+        else:
+            segment_before = min(segment.first_id for segment in segments)
+    if not archived_by_id:
+        return hot
+    hot_by_id = {message.id: message for message in hot}
+    ids = sorted(archived_by_id.keys() | hot_by_id.keys())
+    ids = ids[:limit] if after_id is not None else ids[-limit:]
+    return [
+        hot_by_id[message_id] if message_id in hot_by_id else schemas.Message(**archived_by_id[message_id])
+        for message_id in ids
+    ]
+
+
+class MessageArchiver:
+    def __init__(self, directory: str = ARCHIVE_DIR, retention_days: int = MESSAGE_RETENTION_DAYS,
+                 batch_size: int = ARCHIVE_BATCH_SIZE, interval: float = ARCHIVE_INTERVAL_SECONDS):
+        self.directory = directory
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self.runs = 0
+        self.segments_written = 0
+        self.messages_archived = 0
+        self.last_run_at: datetime.datetime | None = None
+
+    def _write_segment(self, room_id: int, month: str, messages: list) -> dict:
+        path = f"room_{room_id}/{month}/{messages[0].id}-{messages[-1].id}.jsonl.gz"
+        full_path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # 임시 파일에 다 쓴 뒤 이름을 바꿔, 읽는 쪽이 쓰다 만 파일을 보지 않게 합니다.
+        # 같은 메시지를 다시 보관하면 같은 이름이 되므로 중단 후 재시도해도 파일이 늘지 않습니다.
+        tmp_path = f"{full_path}.tmp"
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                for message in messages:
+                    f.write(schemas.Message.from_orm(message).model_dump_json().encode("utf-8") + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, full_path)
+        return {
+            "room_id": room_id,
+            "month": month,
+            "path": path,
+            "first_id": messages[0].id,
+            "last_id": messages[-1].id,
+            "message_count": len(messages),
+            "last_created_at": max(message.created_at for message in messages),
+        }
+
+    def archive_once(self, now: datetime.datetime | None = None) -> int:
+        """
+        보관 기간이 지난 메시지를 모두 세그먼트로 옮기고 옮긴 메시지 수를 반환합니다.
+        """
+        cutoff = (now or datetime.datetime.utcnow()) - datetime.timedelta(days=self.retention_days)
+        archived = 0
+        while True:
+            with SessionLocal() as db:
+                messages = crud.get_messages_older_than(db, cutoff=cutoff, limit=self.batch_size)
+                if not messages:
+                    break
+                groups = defaultdict(list)
+                for message in messages:
+                    groups[(message.room_id, f"{message.created_at:%Y-%m}")].append(message)
+                segments = [self._write_segment(room_id, month, group) for (room_id, month), group in groups.items()]
+                # 색인 추가와 삭제는 한 트랜잭션입니다. 다른 워커가 먼저 옮겼으면 False.
+                if not crud.archive_messages(db, segments, [message.id for message in messages]):
+                    break
+            self.segments_written += len(segments)
+            archived += len(messages)
+        self.runs += 1
+        self.messages_archived += archived
+        self.last_run_at = datetime.datetime.utcnow()
+        return archived
+
+    async def start(self):
+        if self.retention_days > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await asyncio.to_thread(self.archive_once)
+                if archived:
+                    print(f"Archived {archived} messages older than {self.retention_days} days")
+            except Exception as e:
+                print("Message archive error:", e)
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "retention_days": self.retention_days,
+            "runs": self.runs,
+            "segments_written": self.segments_written,
+            "messages_archived": self.messages_archived,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "cached_segments": len(_segment_cache),
+            "segment_cache_hits": _segment_cache.hits,
+            "segment_cache_misses": _segment_cache.misses,
+        }
+
+
+message_archiver = MessageArchiver()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=MESSAGE_RETENTION_DAYS or 90, help="이보다 오래된 메시지를 보관")
+    parser.add_argument("--dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    archiver = MessageArchiver(directory=args.dir, retention_days=args.days)
+    print(f"Archived {archiver.archive_once()} messages into {archiver.segments_written} segments")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# 검증을 마친 토큰을 기억할 최대 개수. 각 토큰은 exp가 지나면 버립니다.
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_PRINCIPAL_CACHE_SIZE = int(os.getenv("AUTH_PRINCIPAL_CACHE_SIZE", "10000"))
+# 인증된 사용자 정보를 DB에서 다시 읽기 전까지 재사용할 시간(초)
+AUTH_PRINCIPAL_TTL = float(os.getenv("AUTH_PRINCIPAL_TTL", "30"))
+
+
+def _token_key(token: str) -> str:
+    # 원문 토큰을 메모리에 들고 있지 않도록 해시를 키로 씁니다.
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class _ExpiringLRU:
+    """
+    항목마다 만료 시각(time.time() 기준)을 가지는 스레드 안전 LRU.
+    동기 의존성(get_current_user)은 스레드풀에서 실행되므로 락으로 보호합니다.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[object, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value, expires_at: float):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class VerifiedTokenCache(_ExpiringLRU):
+    """
+    서명/만료 검증을 통과한 JWT의 클레임 캐시. 토큰의 exp까지만 유효합니다.
+    """
+
+    def __init__(self, max_entries: int = AUTH_TOKEN_CACHE_SIZE):
+        super().__init__(max_entries)
+
+    def get_claims(self, token: str) -> dict | None:
+        return self.get(_token_key(token))
+
+    def remember(self, token: str, claims: dict):
+        exp = claims.get("exp")
+        if exp is not None:
+            self.set(_token_key(token), claims, float(exp))
+
+
+class PrincipalCache(_ExpiringLRU):
+    """
+    username -> 인증된 사용자(schemas.User) 캐시. 짧은 TTL로 두고 사용자 정보가 바뀌면 invalidate 합니다.
+    """
+
+    def __init__(self, max_entries: int = AUTH_PRINCIPAL_CACHE_SIZE, ttl: float = AUTH_PRINCIPAL_TTL):
+        super().__init__(max_entries)
+        self.ttl = ttl
+
+    def remember(self, username: str, user):
+        self.set(username, user, time.time() + self.ttl)
+
+    def invalidate(self, username: str):
+        self.pop(username)
+
+
+verified_tokens = VerifiedTokenCache()
+principals = PrincipalCache()
@@ -0,0 +1,67 @@
+"""
+messages 기록으로 message_rollups(사용자/방별 시간·일 집계)를 다시 계산합니다.
+집계를 처음 배포한 뒤, 또는 집계가 어긋났을 때 실행합니다.
+
+    python backfill_rollups.py               # 가장 오래된 메시지부터 어제까지
+    python backfill_rollups.py --days 90     # 최근 90일 (오늘 제외)
+    python backfill_rollups.py --start 2024-01-01 --end 2024-02-01
+
+하루씩 지우고 다시 계산해 커밋하므로 여러 번 실행해도 결과가 같습니다.
+오늘(UTC) 집계는 메시지 저장 경로가 계속 더하고 있으므로 기본 범위에서 뺍니다.
+보관(archive.py)된 메시지가 있는 날짜는 messages만으로 다시 셀 수 없으므로 건너뛰고 기존 집계를 그대로 둡니다.
+배포한 날의 집계는 배포 이후 메시지만 담기므로, 다음 날 한 번 더 실행하면 채워집니다.
+"""
+import argparse
+import datetime
+
+import crud
+import models
+from database import SessionLocal, engine
+
+
+def _date(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value, "%Y-%m-%d")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, help="오늘 이전 이 일수만큼 다시 계산")
+    parser.add_argument("--start", type=_date, help="YYYY-MM-DD (UTC, 포함)")
+    parser.add_argument("--end", type=_date, help="YYYY-MM-DD (UTC, 제외). 기본은 오늘")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    today = crud.rollup_bucket_start(datetime.datetime.utcnow(), "day")
+    end = args.end or today
+    with SessionLocal() as db:
+        if args.start is not None:
+            start = args.start
+        elif args.days is not None:
+            start = end - datetime.timedelta(days=args.days)
+        else:
+            oldest = crud.get_oldest_message_time(db)
+            if oldest is None:
+                print("No messages to backfill")
+                return
+            start = crud.rollup_bucket_start(oldest, "day")
+
+        archived_until = crud.get_archived_until(db)
+        if archived_until is not None:
+            first_rebuildable = crud.rollup_bucket_start(archived_until, "day") + datetime.timedelta(days=1)
+            if start < first_rebuildable:
+                print(f"Skipping {start:%Y-%m-%d} to {first_rebuildable:%Y-%m-%d} (exclusive): messages are archived")
+                start = first_rebuildable
+
+        day = start
+        total = 0
+        while day < end:
+            next_day = day + datetime.timedelta(days=1)
+            counted = crud.rebuild_message_rollups(db, start=day, end=next_day)
+            total += counted
+            print(f"{day:%Y-%m-%d}: {counted} messages")
+            day = next_day
+    print(f"Rebuilt rollups for {total} messages")
+
+
+if __name__ == "__main__":
+    main()
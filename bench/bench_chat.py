@@ -0,0 +1,357 @@
+"""
+채팅 경로 종단 간 부하 벤치마크: 스텁 AI 서버 + 앱 서버 + 여러 방에 흩어진 다수의 WebSocket 클라이언트.
+
+    python -m bench.bench_chat --clients 2000 --rooms 100 --duration 30
+    python -m bench.bench_chat --database-url mysql+pymysql://root:pw@127.0.0.1:3306/kitty
+    python -m bench.bench_chat --save-baseline      # bench/baselines/chat.json 갱신
+
+스텁과 앱은 별도 프로세스로 띄워 앱의 메모리만 따로 잽니다. 이 프로세스는 클라이언트만 돌립니다.
+앱 설정(CHAT_PIPELINE_ENABLED, WRITE_BEHIND_ENABLED 등)은 환경 변수로 넘기면 그대로 적용됩니다.
+
+클라이언트마다 사용자 하나로 로그인해 자기 방에 메시지를 보내고, 그 메시지가 브로드캐스트되어
+돌아올 때까지의 시간(send-to-broadcast)을 잽니다. 클라이언트는 한 번에 메시지 하나만 보냅니다.
+--baseline 결과와 비교해 처리량이나 지연, 연결당 메모리가 --tolerance 이상 나빠지면 종료 코드 1로 끝납니다.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+import websockets
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, "bench", "baselines", "chat.json")
+
+# 값이 클수록 좋은 지표와 작을수록 좋은 지표
+HIGHER_IS_BETTER = ("messages_per_second",)
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "memory_per_connection_kb")
+
+
+def raise_fd_limit():
+    # 클라이언트 수천 개를 열려면 기본 파일 디스크립터 한도(1024)로는 모자랍니다.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def rss_kb(pid: int) -> int | None:
+    """
+    프로세스의 RSS(KB). /proc이 없는 환경에서는 None.
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+def spawn(args: list[str], env: dict, port: int) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", *args, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_ROOT,
+        env=env,
+        # 결과 JSON만 stdout에 남도록 서버 로그는 stderr로 보냅니다.
+        stdout=sys.stderr,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{args[0]} exited with code {process.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{args[0]} did not start on port {port}")
+
+
+def app_env(args, stub_url: str) -> dict:
+    env = dict(os.environ)
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    else:
+        env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    env.setdefault("SECRET_KEY", "bench")
+    env.setdefault("ALGORITHM", "HS256")
+    env.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "120")
+    env.setdefault("KITTY_API_KEY", "bench")
+    env.setdefault("QUIZ_REPORT_AI_API_KEY", "bench")
+    # 사용자 수천 명을 만드는 시간이 측정을 압도하지 않도록 bcrypt 비용을 낮춥니다.
+    env.setdefault("PASSWORD_BCRYPT_ROUNDS", "4")
+    # 모든 클라이언트가 같은 IP에서 가입/로그인하므로 IP별 제한을 끕니다.
+    env.setdefault("AUTH_RATE_LIMIT_PER_MINUTE", "0")
+    env["AI_SERVER_URL"] = stub_url
+    env["AI_AGENT_API_URL"] = stub_url
+    env["QUIZ_REPORT_AI_API_URL"] = stub_url
+    return env
+
+
+async def _post_with_retry(client: httpx.AsyncClient, url: str, **kwargs) -> httpx.Response:
+    # 비밀번호 해시 풀이 가득 차면 503 + Retry-After로 돌려보냅니다.
+    while True:
+        response = await client.post(url, **kwargs)
+        if response.status_code != 503:
+            response.raise_for_status()
+            return response
+        await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+
+
+async def setup(base_url: str, clients: int, rooms: int, concurrency: int = 16) -> tuple[list[int], list[tuple[int, str]]]:
+    """
+    방과 사용자(클라이언트마다 하나)를 만들고 토큰을 받습니다.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        room_ids = []
+        for r in range(rooms):
+            response = await _post_with_retry(client, "/rooms/", json={"name": f"bench-{run_id}-{r}"})
+            room_ids.append(response.json()["id"])
+
+        async def user(i: int) -> tuple[int, str]:
+            username = f"bench-{run_id}-{i}"
+            async with semaphore:
+                response = await _post_with_retry(client, "/users/", json={
+                    "username": username, "phone_number": f"bench-{run_id}-{i}", "password": "bench-password"
+                })
+                user_id = response.json()["id"]
+                response = await _post_with_retry(
+                    client, "/token", data={"username": username, "password": "bench-password"}
+                )
+                return user_id, response.json()["access_token"]
+
+        users = await asyncio.gather(*(user(i) for i in range(clients)))
+    return room_ids, users
+
+
+class SwarmClient:
+    def __init__(self, user_id: int, token: str, room_id: int):
+        self.user_id = user_id
+        self.token = token
+        self.room_id = room_id
+        self.websocket = None
+        self.frames = 0
+        self._waiting: asyncio.Future | None = None
+
+    async def connect(self, ws_url: str):
+        self.websocket = await websockets.connect(
+            f"{ws_url}/ws/{self.room_id}?token={self.token}", max_size=None, open_timeout=120, ping_interval=None
+        )
+
+    async def read(self):
+        try:
+            async for raw in self.websocket:
+                self.frames += 1
+                if self._waiting is None or self._waiting.done():
+                    continue
+                event = json.loads(raw)
+                if event.get("type") == "new_message" and event["message"]["owner_id"] == self.user_id:
+                    self._waiting.set_result(time.perf_counter())
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send(self, content: str, timeout: float) -> float | None:
+        """
+        메시지를 보내고 자기 메시지가 브로드캐스트될 때까지 걸린 시간(초). 시간 초과면 None.
+        """
+        self._waiting = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        await self.websocket.send(json.dumps({"content": content, "sender_id": self.user_id}))
+        try:
+            received = await asyncio.wait_for(self._waiting, timeout)
+        except asyncio.TimeoutError:
+            return None
+        return received - started
+
+
+async def run(args, base_url: str, app_pid: int | None) -> dict:
+    ws_url = base_url.replace("http", "ws", 1)
+    room_ids, users = await setup(base_url, args.clients, args.rooms)
+    clients = [SwarmClient(user_id, token, room_ids[i % len(room_ids)]) for i, (user_id, token) in enumerate(users)]
+    texts = [f"bench text {i}" for i in range(args.distinct_texts)]
+
+    rss_before = rss_kb(app_pid) if app_pid else None
+    semaphore = asyncio.Semaphore(100)
+
+    async def connect(client: SwarmClient):
+        async with semaphore:
+            await client.connect(ws_url)
+
+    connect_started = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in clients))
+    connect_seconds = time.perf_counter() - connect_started
+    await asyncio.sleep(1)
+    rss_connected = rss_kb(app_pid) if app_pid else None
+    readers = [asyncio.create_task(client.read()) for client in clients]
+
+    latencies: list[float] = []
+    counters = {"sent": 0, "timeouts": 0, "disconnects": 0}
+    measure_from = time.perf_counter() + args.warmup
+    stop_at = measure_from + args.duration
+
+    async def drive(client: SwarmClient):
+        # 클라이언트마다 시작 시각을 흩어 동시에 몰리지 않게 합니다.
+        await asyncio.sleep(random.uniform(0, args.think_ms / 1000))
+        seq = 0
+        while time.perf_counter() < stop_at:
+            seq += 1
+            content = random.choice(texts) if texts else f"bench message {client.user_id} {seq}"
+            started = time.perf_counter()
+            try:
+                latency = await client.send(content, args.timeout)
+            except websockets.ConnectionClosed:
+                # 서버가 끊은 연결(오류, 느린 소비자 정리 등)은 세고 그 클라이언트만 멈춥니다.
+                counters["disconnects"] += 1
+                return
+            if started >= measure_from:
+                counters["sent"] += 1
+                if latency is None:
+                    counters["timeouts"] += 1
+                else:
+                    latencies.append(latency)
+            if args.think_ms > 0:
+                await asyncio.sleep(min(random.expovariate(1000 / args.think_ms), max(stop_at - time.perf_counter(), 0)))
+
+    await asyncio.gather(*(drive(client) for client in clients))
+    elapsed = stop_at - measure_from
+    rss_after = rss_kb(app_pid) if app_pid else None
+
+    for client in clients:
+        await client.websocket.close()
+    await asyncio.gather(*readers, return_exceptions=True)
+
+    memory_per_connection = None
+    if rss_before is not None and rss_connected is not None:
+        memory_per_connection = round((rss_connected - rss_before) / len(clients), 1)
+    p50 = percentile(latencies, 50)
+    p99 = percentile(latencies, 99)
+    return {
+        "messages": len(latencies),
+        "timeouts": counters["timeouts"],
+        "disconnects": counters["disconnects"],
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(len(latencies) / elapsed, 1),
+        "frames_received": sum(client.frames for client in clients),
+        "p50_ms": round(p50 * 1000, 2) if p50 is not None else None,
+        "p99_ms": round(p99 * 1000, 2) if p99 is not None else None,
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else None,
+        "connect_seconds": round(connect_seconds, 3),
+        "memory_per_connection_kb": memory_per_connection,
+        "app_rss_kb": {"before": rss_before, "connected": rss_connected, "after": rss_after},
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    기준 결과보다 tolerance(비율) 이상 나빠진 지표 목록.
+    """
+    regressions = []
+    for key in HIGHER_IS_BETTER + LOWER_IS_BETTER:
+        current, expected = result.get(key), baseline.get(key)
+        if current is None or not expected:
+            continue
+        change = (current - expected) / expected
+        if (key in HIGHER_IS_BETTER and change < -tolerance) or (key in LOWER_IS_BETTER and change > tolerance):
+            regressions.append(f"{key}: {expected} -> {current} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--rooms", type=int, default=25)
+    parser.add_argument("--duration", type=float, default=20, help="측정 시간(초)")
+    parser.add_argument("--warmup", type=float, default=3, help="측정에서 뺄 시작 구간(초)")
+    parser.add_argument("--think-ms", type=float, default=10000, help="클라이언트별 메시지 사이 평균 대기")
+    parser.add_argument("--timeout", type=float, default=10, help="브로드캐스트를 기다릴 최대 시간(초)")
+    parser.add_argument("--distinct-texts", type=int, default=0,
+                        help="보낼 문장 종류 수. 0이면 매번 다른 문장(유해성 캐시 미적중)")
+    parser.add_argument("--stub-latency-ms", type=float, default=50)
+    parser.add_argument("--harmful-ratio", type=float, default=0.2)
+    parser.add_argument("--database-url", help="기본은 임시 SQLite. 예: mysql+pymysql://root:pw@127.0.0.1:3306/kitty")
+    parser.add_argument("--url", help="이미 떠 있는 앱 주소. 주면 스텁/앱을 띄우지 않고 메모리도 재지 않습니다.")
+    parser.add_argument("--app-port", type=int, default=9002)
+    parser.add_argument("--stub-port", type=int, default=9003)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="이번 결과를 --baseline 파일에 저장")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    processes = []
+    try:
+        base_url = args.url
+        app_pid = None
+        if base_url is None:
+            stub_env = dict(os.environ)
+            stub_env["STUB_LATENCY_MS"] = str(args.stub_latency_ms)
+            stub_env["STUB_HARMFUL_RATIO"] = str(args.harmful_ratio)
+            processes.append(spawn(["bench.stub_ai_server:app"], stub_env, args.stub_port))
+            app = spawn(["main:app"], app_env(args, f"http://127.0.0.1:{args.stub_port}"), args.app_port)
+            processes.append(app)
+            base_url = f"http://127.0.0.1:{args.app_port}"
+            app_pid = app.pid
+        result = asyncio.run(run(args, base_url, app_pid))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=30)
+
+    config = {
+        key: getattr(args, key)
+        for key in ("clients", "rooms", "duration", "think_ms", "distinct_texts", "stub_latency_ms", "harmful_ratio")
+    }
+    config["database"] = "mysql" if (args.database_url or "").startswith("mysql") else "sqlite"
+    config["pipeline"] = os.getenv("CHAT_PIPELINE_ENABLED", "0") == "1"
+    config["write_behind"] = os.getenv("WRITE_BEHIND_ENABLED", "0") == "1"
+    print(json.dumps({"config": config, "result": result}, indent=2))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "config": config,
+                "machine": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+                "result": result,
+            }, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print(f"Baseline config differs, comparison may not be meaningful: {baseline.get('config')}")
+    regressions = compare(result, baseline["result"], args.tolerance)
+    if regressions:
+        print("Regressions against baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
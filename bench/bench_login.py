@@ -0,0 +1,103 @@
+"""
+로그인(/token) 처리량 벤치마크: bcrypt 풀 크기별 초당 로그인 수와, 그동안 다른 요청의 지연.
+
+    python -m bench.bench_login --logins 200 --concurrency 50 --pool-sizes 1,2,4,8
+
+임시 SQLite DB로 앱을 같은 프로세스에서 띄우므로 MySQL이 필요 없습니다.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import uvicorn
+
+
+def start_app(port: int) -> uvicorn.Server:
+    import main as app_main
+
+    server = uvicorn.Server(uvicorn.Config(app_main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run(base_url: str, logins: int, concurrency: int) -> dict:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses: dict[int, int] = {}
+    probe_latencies: list[float] = []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        async def login():
+            async with semaphore:
+                response = await client.post("/token", data={"username": "bench", "password": "bench-password"})
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def probe():
+            # 로그인이 몰리는 동안 가벼운 요청이 얼마나 늦어지는지 봅니다.
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/chat/stats")
+                probe_latencies.append((time.perf_counter() - started) * 1000)
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    return {
+        "seconds": round(elapsed, 3),
+        "logins_per_second": round(statuses.get(200, 0) / elapsed, 1),
+        "statuses": statuses,
+        "probe_p50_ms": round(statistics.median(probe_latencies), 2) if probe_latencies else None,
+        "probe_max_ms": round(max(probe_latencies), 2) if probe_latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--pool-sizes", default="1,2,4,8")
+    parser.add_argument("--port", type=int, default=9001)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{db_path}")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ.setdefault("ALGORITHM", "HS256")
+    os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+    # 같은 IP, 같은 사용자로 로그인을 몰아 보내므로 IP별/사용자 이름별 제한을 끕니다.
+    os.environ.setdefault("AUTH_RATE_LIMIT_PER_MINUTE", "0")
+    os.environ.setdefault("LOGIN_RATE_LIMIT_PER_USERNAME_PER_MINUTE", "0")
+
+    start_app(args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    import httpx
+    from password_hashing import password_hasher
+
+    httpx.post(f"{base_url}/users/", json={
+        "username": "bench", "phone_number": "000-0000-0000", "password": "bench-password"
+    }, timeout=60)
+
+    for pool_size in (int(size) for size in args.pool_sizes.split(",")):
+        # 앱이 쓰는 풀을 크기만 바꿔 다시 만듭니다.
+        password_hasher.close()
+        password_hasher.workers = pool_size
+        result = asyncio.run(run(base_url, args.logins, args.concurrency))
+        print({"pool_size": pool_size, **result})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+유해성 판단 경로 처리량 벤치마크 (메시지별 호출 vs 마이크로 배치).
+
+    python -m bench.bench_moderation --messages 2000 --concurrency 200
+
+스텁 AI 서버를 같은 프로세스에서 띄우므로 외부 서버가 필요 없습니다.
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+import uvicorn
+
+
+def start_stub(port: int) -> uvicorn.Server:
+    from bench.stub_ai_server import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run(messages: int, concurrency: int, batched: bool, base_url: str) -> dict:
+    import ai_request
+    from moderation_batcher import ModerationBatcher
+
+    # 캐시와 prefilter를 거치지 않고 업스트림 경로만 측정합니다.
+    batcher = ModerationBatcher(ai_request.post_json, base_url)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            text = f"bench message {i}"
+            if batched:
+                await batcher.submit(text)
+            else:
+                await ai_request.post_json(f"{base_url}/process_text", {"text": text})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(messages)))
+    elapsed = time.perf_counter() - started
+    await batcher.close()
+    await ai_request.close_client()
+    return {
+        "mode": "batched" if batched else "per-message",
+        "messages": messages,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 1),
+        "upstream_requests": batcher.batches_sent if batched else messages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--url", help="이미 떠 있는 AI 서버(또는 스텁) 주소. 없으면 스텁을 띄웁니다.")
+    args = parser.parse_args()
+
+    base_url = args.url
+    if base_url is None:
+        start_stub(args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+    os.environ.setdefault("AI_SERVER_URL", base_url)
+
+    for batched in (False, True):
+        print(asyncio.run(run(args.messages, args.concurrency, batched, base_url)))
+
+
+if __name__ == "__main__":
+    main()
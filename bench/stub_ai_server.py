@@ -0,0 +1,141 @@
+"""
+오프라인 벤치마크용 AI 서버 스텁.
+
+    STUB_LATENCY_MS=50 STUB_HARMFUL_RATIO=0.2 uvicorn bench.stub_ai_server:app --port 9000
+
+STUB_BATCH=0 으로 실행하면 /process_text_batch 가 없는 업스트림을 흉내 냅니다.
+엔드포인트별 지연: STUB_MODERATION_LATENCY_MS, STUB_STORY_LATENCY_MS, STUB_CHAT_DATA_LATENCY_MS (없으면 STUB_LATENCY_MS).
+
+장애 주입: STUB_ERROR_RATE(5xx 비율), STUB_SLOW_RATIO/STUB_SLOW_MS(느린 꼬리 응답).
+실행 중에는 POST /fault {"latency_ms": 500, "error_rate": 1.0, "harmful_ratio": 0.5} 처럼 바꿀 수 있습니다.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "50"))
+STUB_HARMFUL_RATIO = float(os.getenv("STUB_HARMFUL_RATIO", "0.2"))
+STUB_BATCH = os.getenv("STUB_BATCH", "1") == "1"
+
+
+def _optional_float(name: str) -> float | None:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+app = FastAPI(title="Kitty AI stub")
+app.state.requests = 0
+app.state.errors = 0
+app.state.fault = {
+    "latency_ms": STUB_LATENCY_MS,
+    "moderation_latency_ms": _optional_float("STUB_MODERATION_LATENCY_MS"),
+    "story_latency_ms": _optional_float("STUB_STORY_LATENCY_MS"),
+    "chat_data_latency_ms": _optional_float("STUB_CHAT_DATA_LATENCY_MS"),
+    "harmful_ratio": STUB_HARMFUL_RATIO,
+    "error_rate": float(os.getenv("STUB_ERROR_RATE", "0")),
+    "slow_ratio": float(os.getenv("STUB_SLOW_RATIO", "0")),
+    "slow_ms": float(os.getenv("STUB_SLOW_MS", "2000")),
+}
+
+
+class FaultConfig(BaseModel):
+    latency_ms: float | None = None
+    moderation_latency_ms: float | None = None
+    story_latency_ms: float | None = None
+    chat_data_latency_ms: float | None = None
+    harmful_ratio: float | None = None
+    error_rate: float | None = None
+    slow_ratio: float | None = None
+    slow_ms: float | None = None
+
+
+async def _respond(endpoint: str):
+    """
+    설정된 지연/오류를 흉내 냅니다. endpoint: moderation | story | chat_data
+    """
+    fault = app.state.fault
+    app.state.requests += 1
+    latency_ms = fault[f"{endpoint}_latency_ms"]
+    if latency_ms is None:
+        latency_ms = fault["latency_ms"]
+    if random.random() < fault["slow_ratio"]:
+        latency_ms = fault["slow_ms"]
+    await asyncio.sleep(latency_ms / 1000)
+    if random.random() < fault["error_rate"]:
+        app.state.errors += 1
+        raise HTTPException(status_code=503, detail="Injected failure")
+
+
+class TextRequest(BaseModel):
+    text: str
+
+
+class BatchRequest(BaseModel):
+    texts: list[str]
+
+
+def _is_harmful(text: str) -> bool:
+    # 같은 문장은 항상 같은 판정을 받도록 해시로 결정합니다.
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2**32 < app.state.fault["harmful_ratio"]
+
+
+def moderate(text: str) -> dict:
+    processed_text = text
+    if _is_harmful(text):
+        processed_text = json.dumps(
+            {"대체 문장": "고운 말을 써요", "문장중 유해한 단어들": [text.split()[0] if text.split() else text]},
+            ensure_ascii=False,
+        )
+    return {"original_text": text, "processed_text": processed_text}
+
+
+@app.post("/process_text")
+async def process_text(request: TextRequest):
+    await _respond("moderation")
+    return moderate(request.text)
+
+
+@app.post("/process_text_batch")
+async def process_text_batch(request: BatchRequest):
+    if not STUB_BATCH:
+        raise HTTPException(status_code=404, detail="Not Found")
+    await _respond("moderation")
+    return {"results": [moderate(text) for text in request.texts]}
+
+
+@app.post("/generate-story")
+async def generate_story(request: dict):
+    await _respond("story")
+    risk_score = request.get("risk_score", 50)
+    return {
+        "final_story": f"risk_score {risk_score}의 고양이 이야기",
+        "final_image_path": f"/static/stories/{risk_score}.png",
+    }
+
+
+@app.post("/process_chat_data")
+async def process_chat_data(request: dict):
+    await _respond("chat_data")
+    word = (request.get("original_text") or "").split()[:1] or [""]
+    return {
+        "message": "ok",
+        "quiz_results": [{"bad_word": word[0], "reason": "친구가 속상할 수 있어요", "quiz": "어떻게 바꿔 말할까요?"}],
+        "report_results": {"summary": "유해 표현이 반복되었습니다.", "advice": "고운 말 쓰기를 함께 연습해 주세요."},
+    }
+
+
+@app.post("/fault")
+def set_fault(config: FaultConfig):
+    app.state.fault.update(config.model_dump(exclude_none=True))
+    return app.state.fault
+
+
+@app.get("/stats")
+def stats():
+    return {"requests": app.state.requests, "errors": app.state.errors, "fault": app.state.fault}
@@ -0,0 +1,242 @@
+"""
+방 메시지를 여러 워커/노드로 퍼뜨리는 브로드캐스트 백엔드.
+
+BROADCAST_URL 로 선택합니다.
+    memory://                  단일 프로세스 (기본값)
+    unix:///tmp/kitty.sock     로컬 Unix 소켓 브로커 (python -m broadcast_backend /tmp/kitty.sock)
+    redis://localhost:6379/0   Redis pub/sub (redis 패키지 필요)
+"""
+import asyncio
+import json
+import os
+import sys
+from urllib.parse import urlparse
+
+from pydantic_core import to_json
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis 백엔드를 쓸 때만 필요합니다.
+    aioredis = None
+
+BROADCAST_URL = os.getenv("BROADCAST_URL", "memory://")
+BROADCAST_CHANNEL_PREFIX = os.getenv("BROADCAST_CHANNEL_PREFIX", "kitty:room:")
+BROADCAST_RECONNECT_SECONDS = float(os.getenv("BROADCAST_RECONNECT_SECONDS", "1"))
+
+_LINE_LIMIT = 2 ** 20
+
+
+class BroadcastBackend:
+    """
+    백엔드 공통 인터페이스. deliver(room_id, payload)는 이 워커에 연결된 소켓으로의 팬아웃입니다.
+    """
+
+    async def start(self, deliver):
+        self._deliver = deliver
+
+    async def publish(self, room_id: int, payload: dict):
+        raise NotImplementedError
+
+    async def subscribe(self, room_id: int):
+        pass
+
+    async def unsubscribe(self, room_id: int):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class MemoryBackend(BroadcastBackend):
+    """
+    같은 프로세스 안에서만 전달합니다.
+    """
+
+    async def publish(self, room_id: int, payload: dict):
+        await self._deliver(room_id, payload)
+
+
+class UnixSocketBackend(BroadcastBackend):
+    """
+    로컬 Unix 소켓 브로커를 통해 같은 머신의 여러 uvicorn 워커를 잇습니다.
+    연결이 끊기면 다시 접속해 구독을 복구합니다.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._rooms: set[int] = set()
+        self._writer: asyncio.StreamWriter | None = None
+        self._reader_task: asyncio.Task | None = None
+        self._connected = asyncio.Event()
+
+    async def start(self, deliver):
+        await super().start(deliver)
+        self._reader_task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=_LINE_LIMIT)
+            except OSError as e:
+                print(f"Broadcast broker unavailable at {self.path}: {e}")
+                await asyncio.sleep(BROADCAST_RECONNECT_SECONDS)
+                continue
+            self._writer = writer
+            for room_id in self._rooms:
+                writer.write(f"SUB {room_id}\n".encode())
+            self._connected.set()
+            try:
+                while line := await reader.readline():
+                    _, room_id, data = line.split(b" ", 2)
+                    try:
+                        await self._deliver(int(room_id), json.loads(data))
+                    except Exception as e:
+                        print("Broadcast delivery error:", e)
+            except (OSError, ValueError) as e:
+                print("Broadcast broker connection error:", e)
+            self._connected.clear()
+            self._writer = None
+            writer.close()
+            await asyncio.sleep(BROADCAST_RECONNECT_SECONDS)
+
+    async def _send(self, line: bytes):
+        await self._connected.wait()
+        self._writer.write(line)
+        await self._writer.drain()
+
+    async def publish(self, room_id: int, payload: dict):
+        if not self._connected.is_set():
+            # 브로커가 내려가 있으면 최소한 이 워커의 소켓에는 전달합니다.
+            await self._deliver(room_id, payload)
+            return
+        await self._send(b"PUB %d " % room_id + to_json(payload) + b"\n")
+
+    async def subscribe(self, room_id: int):
+        self._rooms.add(room_id)
+        if self._writer is not None:
+            await self._send(f"SUB {room_id}\n".encode())
+
+    async def unsubscribe(self, room_id: int):
+        self._rooms.discard(room_id)
+        if self._writer is not None:
+            await self._send(f"UNSUB {room_id}\n".encode())
+
+    async def stop(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+
+
+class RedisBackend(BroadcastBackend):
+    """
+    Redis pub/sub. 방마다 채널 하나를 쓰고, 이 워커에 소켓이 있는 방만 구독합니다.
+    """
+
+    def __init__(self, url: str):
+        if aioredis is None:
+            raise RuntimeError("BROADCAST_URL uses redis:// but the redis package is not installed")
+        self._redis = aioredis.from_url(url)
+        self._pubsub = self._redis.pubsub()
+        self._reader_task: asyncio.Task | None = None
+
+    def _channel(self, room_id: int) -> str:
+        return f"{BROADCAST_CHANNEL_PREFIX}{room_id}"
+
+    async def start(self, deliver):
+        await super().start(deliver)
+        self._reader_task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            if not self._pubsub.subscribed:
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except Exception as e:
+                print("Redis broadcast error:", e)
+                await asyncio.sleep(BROADCAST_RECONNECT_SECONDS)
+                continue
+            if message is None or message["type"] != "message":
+                continue
+            channel = message["channel"].decode()
+            try:
+                await self._deliver(int(channel[len(BROADCAST_CHANNEL_PREFIX):]), json.loads(message["data"]))
+            except Exception as e:
+                print("Broadcast delivery error:", e)
+
+    async def publish(self, room_id: int, payload: dict):
+        await self._redis.publish(self._channel(room_id), to_json(payload))
+
+    async def subscribe(self, room_id: int):
+        await self._pubsub.subscribe(self._channel(room_id))
+
+    async def unsubscribe(self, room_id: int):
+        await self._pubsub.unsubscribe(self._channel(room_id))
+
+    async def stop(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+        await self._pubsub.aclose()
+        await self._redis.aclose()
+
+
+def create_backend(url: str = BROADCAST_URL) -> BroadcastBackend:
+    scheme = urlparse(url).scheme
+    if scheme == "memory":
+        return MemoryBackend()
+    if scheme == "unix":
+        return UnixSocketBackend(urlparse(url).path)
+    if scheme in ("redis", "rediss"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported BROADCAST_URL: {url}")
+
+
+async def run_broker(path: str):
+    """
+    UnixSocketBackend용 브로커. 한 머신의 워커들이 같은 소켓 경로로 접속합니다.
+    """
+    rooms: dict[int, set[asyncio.StreamWriter]] = {}
+
+    def _leave(room_id: int, writer: asyncio.StreamWriter):
+        subscribers = rooms.get(room_id)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del rooms[room_id]
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscribed: set[int] = set()
+        try:
+            while line := await reader.readline():
+                command, rest = line.rstrip(b"\n").split(b" ", 1)
+                if command == b"PUB":
+                    room_id, _ = rest.split(b" ", 1)
+                    for subscriber in list(rooms.get(int(room_id), ())):
+                        subscriber.write(b"MSG " + rest + b"\n")
+                elif command == b"SUB":
+                    subscribed.add(int(rest))
+                    rooms.setdefault(int(rest), set()).add(writer)
+                elif command == b"UNSUB":
+                    subscribed.discard(int(rest))
+                    _leave(int(rest), writer)
+        except (OSError, ValueError) as e:
+            print("Broker client error:", e)
+        finally:
+            for room_id in subscribed:
+                _leave(room_id, writer)
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)
+    server = await asyncio.start_unix_server(handle, path, limit=_LINE_LIMIT)
+    print(f"Broadcast broker listening on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_broker(sys.argv[1] if len(sys.argv) > 1 else "/tmp/kitty-broadcast.sock"))
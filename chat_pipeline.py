@@ -0,0 +1,236 @@
+import asyncio
+import datetime
+import os
+import time
+import uuid
+
+import ai_request
+import crud
+import schemas
+import write_behind
+from database import AsyncSessionLocal
+from metrics import chat_stage_seconds, errors_total
+from scoring import status_delta
+from user_state import user_states
+from write_behind import message_writer
+
+CHAT_PIPELINE_ENABLED = os.getenv("CHAT_PIPELINE_ENABLED", "0") == "1"
+# 방마다 대기할 수 있는 최대 메시지 수. 가득 차면 소켓의 receive 루프가 기다립니다.
+CHAT_PIPELINE_QUEUE_SIZE = int(os.getenv("CHAT_PIPELINE_QUEUE_SIZE", "100"))
+CHAT_PERSIST_QUEUE_SIZE = int(os.getenv("CHAT_PERSIST_QUEUE_SIZE", "1000"))
+CHAT_PIPELINE_IDLE_SECONDS = float(os.getenv("CHAT_PIPELINE_IDLE_SECONDS", "60"))
+# 방마다 동시에 진행할 수 있는 최대 유해성 판단 수. 브로드캐스트/저장은 그래도 받은 순서대로 합니다.
+CHAT_PIPELINE_MODERATION_CONCURRENCY = int(os.getenv("CHAT_PIPELINE_MODERATION_CONCURRENCY", "8"))
+
+QUIZ_REPORT_THRESHOLD = 10
+
+
+def _persist(db, message_create: schemas.MessageCreate, is_harmful: bool) -> tuple[schemas.Message, tuple[int, str, int] | None]:
+    xp_delta, new_state, harmful_delta = status_delta(is_harmful)
+    status = crud.increment_user_status(
+        db, user_id=message_create.owner_id, xp_delta=xp_delta, character_state=new_state, harmful_delta=harmful_delta
+    )
+    db_message = crud.create_message(db, message_create)
+    return schemas.Message.from_orm(db_message), status
+
+
+class _Room:
+    __slots__ = ("queue", "task", "in_flight")
+
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self.task: asyncio.Task | None = None
+        # 큐에서 꺼냈지만 아직 브로드캐스트까지 끝나지 않은 메시지 수
+        self.in_flight = 0
+
+
+class ChatPipeline:
+    """
+    채팅 메시지를 소켓의 receive 루프 밖에서 처리하는 단계별 파이프라인.
+
+    방마다 하나의 워커가 메시지를 최대 moderation_concurrency개까지 동시에 판정하고, 받은 순서대로 브로드캐스트하며,
+    사용자 상태/메시지 저장은 하나의 영속화 워커가 같은 순서로 뒤이어 처리합니다.
+    브로드캐스트 시점의 메시지에는 id 대신 temp_id가 담기며,
+    저장이 끝나면 같은 temp_id로 message_saved 이벤트를 보냅니다.
+    WRITE_BEHIND_ENABLED이면 저장을 write-behind 버퍼에 맡기고 실제 id로 바로 브로드캐스트합니다.
+    """
+
+    def __init__(self, broadcast, quiz_report, queue_size: int = CHAT_PIPELINE_QUEUE_SIZE,
+                 persist_queue_size: int = CHAT_PERSIST_QUEUE_SIZE, idle_seconds: float = CHAT_PIPELINE_IDLE_SECONDS,
+                 moderation_concurrency: int = CHAT_PIPELINE_MODERATION_CONCURRENCY):
+        self._broadcast = broadcast
+        self._quiz_report = quiz_report
+        self.queue_size = queue_size
+        self.persist_queue_size = persist_queue_size
+        self.idle_seconds = idle_seconds
+        self.moderation_concurrency = moderation_concurrency
+        self._rooms: dict[int, _Room] = {}
+        self._persist_queue: asyncio.Queue | None = None
+        self._persist_worker: asyncio.Task | None = None
+
+    async def submit(self, room_id: int, sender_id: int, content: str):
+        """
+        메시지를 방 큐에 넣습니다. 큐가 가득 차면 자리가 날 때까지 기다립니다.
+        """
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = _Room(asyncio.Queue(maxsize=self.queue_size))
+            room.task = asyncio.create_task(self._run_room(room_id, room))
+            self._rooms[room_id] = room
+        await room.queue.put((sender_id, content))
+
+    async def _run_room(self, room_id: int, room: _Room):
+        # 판정은 바로 시작하고, 순서대로 기다릴 판정 작업을 moderated에 넣습니다.
+        # moderated가 가득 차면(판정이 moderation_concurrency개 진행 중) 새 판정을 시작하지 않습니다.
+        moderated = asyncio.Queue(maxsize=self.moderation_concurrency)
+        publisher = asyncio.create_task(self._publish_in_order(room_id, room, moderated))
+        try:
+            while True:
+                try:
+                    sender_id, content = await asyncio.wait_for(room.queue.get(), self.idle_seconds)
+                except asyncio.TimeoutError:
+                    if room.queue.empty() and room.in_flight == 0:
+                        del self._rooms[room_id]
+                        return
+                    continue
+                room.in_flight += 1
+                await moderated.put((sender_id, content, asyncio.create_task(self._moderate(content))))
+        finally:
+            publisher.cancel()
+            while not moderated.empty():
+                moderated.get_nowait()[2].cancel()
+
+    async def _publish_in_order(self, room_id: int, room: _Room, moderated: asyncio.Queue):
+        while True:
+            sender_id, content, moderation = await moderated.get()
+            try:
+                ai_result = await moderation
+                await self._process(room_id, sender_id, content, ai_result)
+            except Exception as e:
+                errors_total.inc(component="chat_pipeline")
+                print("Chat pipeline error:", e)
+            finally:
+                room.in_flight -= 1
+                room.queue.task_done()
+
+    async def _moderate(self, content: str) -> dict:
+        with chat_stage_seconds.time(path="pipeline", stage="moderation"):
+            return await ai_request.process_text_with_ai(content)
+
+    async def _process(self, room_id: int, sender_id: int, content: str, ai_result: dict):
+        is_harmful = ai_result.get("is_harmful", False)
+        purified_text = ai_result.get("purified_text", content)
+
+        # 사용자 상태는 캐시에 먼저 반영하고, DB 증감은 영속화 워커가 뒤이어 합니다.
+        with chat_stage_seconds.time(path="pipeline", stage="user_update"):
+            status = await user_states.apply(sender_id, is_harmful, write_through=False)
+        if status is None:
+            print(f"Chat pipeline: user {sender_id} not found")
+            return
+        new_xp, new_state, new_harmful_chat_count = status
+
+        message_create = schemas.MessageCreate(
+            room_id=room_id,
+            content=purified_text,
+            owner_id=sender_id,
+            character_state=new_state,
+            experience_points=new_xp,
+            is_harmful=is_harmful,
+            created_at=datetime.datetime.utcnow(),
+        )
+        if write_behind.WRITE_BEHIND_ENABLED:
+            # id가 미리 부여되므로 temp_id/message_saved 없이 완성된 메시지를 바로 보냅니다.
+            try:
+                with chat_stage_seconds.time(path="pipeline", stage="message_insert"):
+                    message = await message_writer.add_message(message_create, status)
+            finally:
+                user_states.settle(sender_id, status)
+        else:
+            temp_id = uuid.uuid4().hex
+            message = {"id": None, "temp_id": temp_id, **message_create.model_dump()}
+        broadcast_started = time.perf_counter()
+        await self._broadcast(
+            {
+                "type": "new_message",
+                "message": message,
+                "user_update": {
+                    "id": sender_id,
+                    "experience_points": new_xp,
+                    "character_state": new_state,
+                    "harmful_chat_count": new_harmful_chat_count
+                },
+                # 퀴즈/리포트는 작업 큐가 만들어 quiz_report 이벤트로 따로 보냅니다.
+                "quiz_results": [],
+                "report_results": {}
+            },
+            room_id=room_id
+        )
+        chat_stage_seconds.observe(time.perf_counter() - broadcast_started, path="pipeline", stage="broadcast")
+        if not write_behind.WRITE_BEHIND_ENABLED:
+            await self._enqueue_persist((temp_id, message_create, is_harmful))
+        if is_harmful and new_harmful_chat_count >= QUIZ_REPORT_THRESHOLD:
+            try:
+                await self._quiz_report(
+                    user_id=sender_id,
+                    room_id=room_id,
+                    original_text=content,
+                    processed_text=ai_result.get("raw_processed_text_from_ai_server", "")
+                )
+            except Exception as e:
+                print(f"Failed to enqueue quiz/report job: {e}")
+
+    async def _enqueue_persist(self, job):
+        if self._persist_worker is None or self._persist_worker.done():
+            self._persist_queue = asyncio.Queue(maxsize=self.persist_queue_size)
+            self._persist_worker = asyncio.create_task(self._run_persist(self._persist_queue))
+        await self._persist_queue.put(job)
+
+    async def _run_persist(self, queue: asyncio.Queue):
+        # 영속화 워커는 세션 하나를 계속 사용합니다.
+        async with AsyncSessionLocal() as db:
+            while True:
+                temp_id, message_create, is_harmful = await queue.get()
+                saved_status = None
+                try:
+                    with chat_stage_seconds.time(path="pipeline", stage="message_insert"):
+                        saved, saved_status = await db.run_sync(_persist, message_create, is_harmful)
+                    await self._broadcast(
+                        {"type": "message_saved", "temp_id": temp_id, "message": saved},
+                        room_id=message_create.room_id
+                    )
+                except Exception as e:
+                    errors_total.inc(component="chat_persist")
+                    print("Chat pipeline persist error:", e)
+                    await db.rollback()
+                finally:
+                    # 저장한 객체를 세션에 쌓아두지 않습니다.
+                    db.expunge_all()
+                    user_states.settle(message_create.owner_id, saved_status)
+                    queue.task_done()
+
+    async def close(self):
+        """
+        대기 중인 메시지를 모두 처리하고 저장한 뒤 워커를 종료합니다.
+        """
+        for room in list(self._rooms.values()):
+            await room.queue.join()
+        if self._persist_queue is not None:
+            await self._persist_queue.join()
+        tasks = [room.task for room in self._rooms.values()]
+        if self._persist_worker is not None:
+            tasks.append(self._persist_worker)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._rooms.clear()
+        self._persist_worker = None
+        self._persist_queue = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": CHAT_PIPELINE_ENABLED,
+            "active_rooms": len(self._rooms),
+            "queued_messages": sum(room.queue.qsize() for room in self._rooms.values()),
+            "in_flight_messages": sum(room.in_flight for room in self._rooms.values()),
+            "queued_writes": self._persist_queue.qsize() if self._persist_queue else 0,
+        }
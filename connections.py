@@ -0,0 +1,206 @@
+import asyncio
+import os
+
+from fastapi import WebSocket
+from pydantic_core import to_jsonable_python
+
+from broadcast_backend import BroadcastBackend, MemoryBackend
+from serialization import BroadcastPayload, accept_subprotocol, negotiate_format, send_payload
+
+# 연결마다 쌓아둘 수 있는 최대 송신 메시지 수
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", "256"))
+# 송신 큐가 가득 찼을 때: drop_oldest | drop_newest | disconnect
+BROADCAST_DROP_POLICY = os.getenv("BROADCAST_DROP_POLICY", "drop_oldest")
+# 연속으로 이만큼 메시지를 버린 느린 클라이언트는 연결을 끊습니다. (0이면 끊지 않음)
+BROADCAST_MAX_DROPS = int(os.getenv("BROADCAST_MAX_DROPS", "100"))
+# send 한 번이 이 시간(초)을 넘기면 죽은 연결로 보고 정리합니다.
+BROADCAST_SEND_TIMEOUT = float(os.getenv("BROADCAST_SEND_TIMEOUT", "10"))
+
+DROP_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+
+# 1013: Try Again Later
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Connection:
+    """
+    WebSocket 하나와 그 전용 송신 큐/writer 태스크.
+    """
+
+    def __init__(self, websocket: WebSocket, room_id: int, queue_size: int, fmt: str, user_id: int | None = None):
+        self.websocket = websocket
+        self.room_id = room_id
+        # 인증된 연결의 사용자 (recipient_id가 있는 메시지의 대상 확인용)
+        self.user_id = user_id
+        self.format = fmt
+        self.queue: asyncio.Queue[BroadcastPayload] = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.consecutive_drops = 0
+        self.writer: asyncio.Task | None = None
+
+
+class ConnectionManager:
+    """
+    방 단위로 WebSocket 연결을 관리하고 메시지를 팬아웃합니다.
+
+    broadcast는 각 연결의 송신 큐에 넣기만 하고 실제 전송은 연결별 writer 태스크가
+    동시에 수행하므로, 느린 클라이언트 하나가 방 전체를 막지 않습니다.
+    메시지는 브로드캐스트 백엔드를 거쳐 같은 방에 접속한 다른 워커/노드에도 전달됩니다.
+    """
+
+    def __init__(self, backend: BroadcastBackend | None = None, history=None, queue_size: int = BROADCAST_QUEUE_SIZE,
+                 drop_policy: str = BROADCAST_DROP_POLICY, max_drops: int = BROADCAST_MAX_DROPS,
+                 send_timeout: float = BROADCAST_SEND_TIMEOUT):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+        self.backend = backend or MemoryBackend()
+        # 전달되는 메시지로 채우는 최근 메시지 버퍼 (message_buffer.RecentMessageBuffer)
+        self.history = history
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.max_drops = max_drops
+        self.send_timeout = send_timeout
+        self.active_connections: dict[int, dict[WebSocket, Connection]] = {}
+        self.dropped_messages = 0
+        self.evicted_connections = 0
+        self._background: set[asyncio.Task] = set()
+
+    async def start(self):
+        await self.backend.start(self._deliver)
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def connect(self, websocket: WebSocket, room_id: int, user_id: int | None = None) -> Connection:
+        await websocket.accept(subprotocol=accept_subprotocol(websocket))
+        connection = Connection(websocket, room_id, self.queue_size, negotiate_format(websocket), user_id)
+        connection.writer = asyncio.create_task(self._write(connection))
+        if room_id not in self.active_connections:
+            self.active_connections[room_id] = {}
+            await self.backend.subscribe(room_id)
+        self.active_connections[room_id][websocket] = connection
+        return connection
+
+    def disconnect(self, websocket: WebSocket, room_id: int):
+        room = self.active_connections.get(room_id)
+        if room is None:
+            return
+        connection = room.pop(websocket, None)
+        if not room:
+            del self.active_connections[room_id]
+            self._spawn(self.backend.unsubscribe(room_id))
+            if self.history is not None and not self.tracks(room_id):
+                # 구독을 끊으면 다른 워커의 메시지를 더 받지 못하므로 버퍼를 버립니다.
+                self.history.evict(room_id)
+        if connection is not None and connection.writer is not None:
+            if connection.writer is not asyncio.current_task():
+                connection.writer.cancel()
+
+    async def broadcast(self, message: dict, room_id: int):
+        """
+        방의 모든 연결(다른 워커 포함)에 메시지를 보냅니다.
+        """
+        await self.backend.publish(room_id, message)
+
+    def tracks(self, room_id: int) -> bool:
+        """
+        이 워커가 방의 모든 메시지를 전달받고 있는지 여부 (최근 메시지 버퍼를 믿을 수 있는지).
+        """
+        return isinstance(self.backend, MemoryBackend) or room_id in self.active_connections
+
+    def _remember(self, room_id: int, message: dict):
+        if message.get("type") not in ("new_message", "message_saved"):
+            return
+        saved = to_jsonable_python(message["message"])
+        if saved.get("id") is not None:
+            self.history.append(room_id, saved)
+
+    async def send(self, connection: Connection, message: dict):
+        """
+        연결 하나에만 메시지를 보냅니다.
+        """
+        self._enqueue(connection, BroadcastPayload(message))
+
+    async def _deliver(self, room_id: int, message: dict):
+        if self.history is not None:
+            self._remember(room_id, message)
+        # 이 워커의 연결들로 팬아웃합니다. 인코딩은 포맷별로 한 번만 수행됩니다.
+        room = self.active_connections.get(room_id)
+        if not room:
+            return
+        payload = BroadcastPayload(message)
+        # recipient_id가 있으면 그 사용자로 인증된 연결에만 보냅니다. 인증 없이 붙은 연결에는 보내지 않습니다.
+        recipient_id = message.get("recipient_id")
+        for connection in list(room.values()):
+            if recipient_id is None or connection.user_id == recipient_id:
+                self._enqueue(connection, payload)
+
+    def _enqueue(self, connection: Connection, message: BroadcastPayload):
+        try:
+            connection.queue.put_nowait(message)
+            connection.consecutive_drops = 0
+            return
+        except asyncio.QueueFull:
+            pass
+
+        self.dropped_messages += 1
+        connection.dropped += 1
+        connection.consecutive_drops += 1
+        if self.drop_policy == "disconnect" or (
+            self.max_drops and connection.consecutive_drops >= self.max_drops
+        ):
+            self._evict(connection)
+        elif self.drop_policy == "drop_oldest":
+            connection.queue.get_nowait()
+            connection.queue.put_nowait(message)
+        # drop_newest: 새 메시지를 버립니다.
+
+    def _evict(self, connection: Connection):
+        self.evicted_connections += 1
+        self.disconnect(connection.websocket, connection.room_id)
+        self._spawn(self._close(connection.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            # 이미 끊긴 연결
+            pass
+
+    async def _write(self, connection: Connection):
+        while True:
+            message = await connection.queue.get()
+            try:
+                await asyncio.wait_for(
+                    send_payload(connection.websocket, message, connection.format), self.send_timeout
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 끊겼거나 응답하지 않는 연결은 방에서 제거합니다.
+                print(f"Dropping websocket in room {connection.room_id}: {e!r}")
+                self.disconnect(connection.websocket, connection.room_id)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.evicted_connections += 1
+                    await self._close(connection.websocket)
+                return
+
+    def stats(self) -> dict:
+        return {
+            "active_rooms": len(self.active_connections),
+            "active_connections": sum(len(room) for room in self.active_connections.values()),
+            "queued_messages": sum(
+                connection.queue.qsize()
+                for room in self.active_connections.values()
+                for connection in room.values()
+            ),
+            "dropped_messages": self.dropped_messages,
+            "evicted_connections": self.evicted_connections,
+            "drop_policy": self.drop_policy,
+            "backend": type(self.backend).__name__,
+        }
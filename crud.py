@@ -1,11 +1,18 @@
 
 
-from sqlalchemy.orm import Session
+import datetime
+
+from sqlalchemy import bindparam, case, func, insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, load_only
 import models
 import schemas
-from passlib.context import CryptContext
+from password_hashing import pwd_context
+from scoring import status_delta
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+ROLLUP_PERIODS = ("hour", "day")
+ROLLUP_UPSERT_CHUNK = 500
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -19,11 +26,20 @@ def get_user_by_username(db: Session, username: str):
 def get_user_by_phone_number(db: Session, phone_number: str):
     return db.query(models.User).filter(models.User.phone_number == phone_number).first()
 
+# 목록 응답에 필요한 컬럼만 읽습니다. (hashed_password 제외)
+_USER_LIST_COLUMNS = (
+    models.User.id, models.User.username, models.User.phone_number, models.User.email,
+    models.User.is_active, models.User.experience_points, models.User.level,
+    models.User.character_state, models.User.harmful_chat_count,
+)
+
 def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+    return db.query(models.User).options(load_only(*_USER_LIST_COLUMNS)).order_by(models.User.id).offset(skip).limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str | None = None):
+    # 해시는 보통 호출자가 password_hasher 풀에서 미리 만들어 넘깁니다.
+    if hashed_password is None:
+        hashed_password = pwd_context.hash(user.password)
     db_user = models.User(
         username=user.username,
         phone_number=user.phone_number,
@@ -35,8 +51,44 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
+def update_password_hash(db: Session, user_id: int, hashed_password: str):
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.hashed_password: hashed_password}, synchronize_session=False
+    )
+    db.commit()
+
 def get_rooms(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Room).offset(skip).limit(limit).all()
+    return db.query(models.Room).order_by(models.Room.id).offset(skip).limit(limit).all()
+
+def get_room_summaries(db: Session, skip: int = 0, limit: int = 100) -> list[schemas.RoomSummary]:
+    """
+    방 목록과 방별 메시지 수/마지막 메시지를 함께 반환합니다.
+    쿼리는 페이지 크기에만 비례합니다: 방 목록, (room_id, id) 인덱스 집계, 마지막 메시지 조회.
+    """
+    rooms = get_rooms(db, skip=skip, limit=limit)
+    if not rooms:
+        return []
+    room_ids = [room.id for room in rooms]
+    stats = {
+        room_id: (message_count, last_message_id)
+        for room_id, message_count, last_message_id in db.query(
+            models.Message.room_id, func.count(models.Message.id), func.max(models.Message.id)
+        ).filter(models.Message.room_id.in_(room_ids)).group_by(models.Message.room_id)
+    }
+    last_message_ids = [last_message_id for _, last_message_id in stats.values()]
+    last_messages = {
+        message.room_id: message
+        for message in db.query(models.Message).filter(models.Message.id.in_(last_message_ids))
+    } if last_message_ids else {}
+    return [
+        schemas.RoomSummary(
+            id=room.id,
+            name=room.name,
+            message_count=stats.get(room.id, (0, None))[0],
+            last_message=last_messages.get(room.id),
+        )
+        for room in rooms
+    ]
 
 def create_room(db: Session, room: schemas.RoomCreate):
     db_room = models.Room(name=room.name)
@@ -45,12 +97,27 @@ def create_room(db: Session, room: schemas.RoomCreate):
     db.refresh(db_room)
     return db_room
 
-def get_messages(db: Session, room_id: int, offset: int = 0, limit: int = 100):
-    return db.query(models.Message).filter(models.Message.room_id == room_id).offset(offset).limit(limit).all()
+def get_messages(db: Session, room_id: int, before_id: int | None = None, after_id: int | None = None, limit: int = 100):
+    """
+    방 메시지를 id 오름차순으로 최대 limit개 반환합니다. (키셋 페이지네이션)
+    커서가 없으면 최신 메시지, before_id면 그 이전, after_id면 그 이후 메시지를 돌려줍니다.
+    """
+    query = db.query(models.Message).filter(models.Message.room_id == room_id)
+    if after_id is not None:
+        return query.filter(models.Message.id > after_id).order_by(models.Message.id.asc()).limit(limit).all()
+    if before_id is not None:
+        query = query.filter(models.Message.id < before_id)
+    messages = query.order_by(models.Message.id.desc()).limit(limit).all()
+    messages.reverse()
+    return messages
 
 def create_message(db: Session, message: schemas.MessageCreate):
-    db_message = models.Message(**message.dict())
+    db_message = models.Message(**message.dict(exclude_none=True))
+    # 집계 버킷을 정해야 하므로 created_at을 여기서 채웁니다.
+    if db_message.created_at is None:
+        db_message.created_at = datetime.datetime.utcnow()
     db.add(db_message)
+    add_message_rollups(db, [{**message.dict(), "created_at": db_message.created_at}])
     db.commit()
     db.refresh(db_message)
     return db_message
@@ -65,3 +132,335 @@ def update_user_status(db: Session, user_id: int, xp: int, character_state: str,
         db.commit()
         db.refresh(db_user)
     return db_user
+
+def _greatest(db: Session, *values):
+    # SQLite에는 GREATEST가 없고, 인자가 여러 개인 MAX가 같은 역할을 합니다.
+    return func.max(*values) if db.get_bind().dialect.name == "sqlite" else func.greatest(*values)
+
+def increment_user_status(db: Session, user_id: int, xp_delta: int, character_state: str,
+                          harmful_delta: int) -> tuple[int, str, int] | None:
+    """
+    경험치/유해 채팅 수를 DB에서 원자적으로 증감하고 갱신된 (경험치, 캐릭터 상태, 유해 채팅 수)를 반환합니다.
+    경험치는 0 미만으로 내려가지 않습니다. 사용자가 없으면 None.
+    UPDATE ... RETURNING을 지원하면 한 문장으로 끝나고, 아니면(MySQL) 같은 트랜잭션에서 다시 읽습니다.
+    다른 워커도 같은 사용자를 갱신할 수 있으므로 캐시 값으로 대신하지 않습니다.
+    """
+    user = models.User
+    statement = (
+        update(user)
+        .where(user.id == user_id)
+        .values(
+            experience_points=_greatest(db, user.experience_points + xp_delta, 0),
+            character_state=character_state,
+            harmful_chat_count=user.harmful_chat_count + harmful_delta,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if db.get_bind().dialect.update_returning:
+        row = db.execute(
+            statement.returning(user.experience_points, user.character_state, user.harmful_chat_count)
+        ).one_or_none()
+        if row is None:
+            db.rollback()
+            return None
+        db.commit()
+        return tuple(row)
+
+    if db.execute(statement).rowcount == 0:
+        db.rollback()
+        return None
+    row = db.execute(
+        select(user.experience_points, user.character_state, user.harmful_chat_count).where(user.id == user_id)
+    ).one()
+    db.commit()
+    return tuple(row)
+
+def reserve_ids(db: Session, name: str, table, count: int) -> int:
+    """
+    table의 id 중 [start, start + count) 구간을 예약하고 start를 반환합니다.
+    여러 워커가 동시에 호출해도 구간이 겹치지 않으며, 기존 최대 id보다 항상 큽니다.
+    """
+    floor = (db.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+    block = models.IdBlock
+    result = db.execute(
+        update(block)
+        .where(block.name == name)
+        .values(next_id=case((block.next_id > floor, block.next_id), else_=floor) + count)
+    )
+    if result.rowcount == 0:
+        try:
+            db.add(block(name=name, next_id=floor + count))
+            db.commit()
+            return floor
+        except IntegrityError:
+            # 다른 워커가 먼저 만들었으면 다시 예약합니다.
+            db.rollback()
+            return reserve_ids(db, name, table, count)
+    next_id = db.execute(select(block.next_id).where(block.name == name)).scalar_one()
+    db.commit()
+    return next_id - count
+
+def insert_messages(db: Session, rows: list[dict]):
+    """
+    id/created_at이 채워진 메시지 여러 개를 한 번의 multi-row INSERT로 저장하고 집계에 더합니다. (커밋은 호출자가)
+    """
+    if rows:
+        db.execute(insert(models.Message), rows)
+        add_message_rollups(db, rows)
+
+def apply_user_status_changes(db: Session, changes: dict[int, tuple[int, int, str, int]]):
+    """
+    여러 사용자의 상태 변경 (경험치 증감, 경험치 하한, 캐릭터 상태, 유해 채팅 수 증감)을 한 번에 반영합니다.
+    경험치는 GREATEST(xp + 증감, 하한)으로 DB에서 증감하므로 다른 경로의 변경을 덮어쓰지 않습니다. (커밋은 호출자가)
+    """
+    if changes:
+        user = models.User.__table__
+        db.execute(
+            update(user)
+            .where(user.c.id == bindparam("user_id"))
+            .values(
+                experience_points=_greatest(db, user.c.experience_points + bindparam("xp_delta"), bindparam("xp_floor")),
+                character_state=bindparam("new_character_state"),
+                harmful_chat_count=user.c.harmful_chat_count + bindparam("harmful_delta"),
+            ),
+            [
+                {"user_id": user_id, "xp_delta": xp_delta, "xp_floor": xp_floor,
+                 "new_character_state": state, "harmful_delta": harmful_delta}
+                for user_id, (xp_delta, xp_floor, state, harmful_delta) in changes.items()
+            ],
+        )
+
+def create_quiz_report_job(db: Session, user_id: int, room_id: int | None, original_text: str, processed_text: str,
+                           dedupe_key: str) -> models.QuizReportJob | None:
+    """
+    퀴즈/리포트 작업을 만듭니다. 같은 dedupe_key의 작업이 이미 있으면 None.
+    """
+    db_job = models.QuizReportJob(
+        user_id=user_id,
+        room_id=room_id,
+        original_text=original_text,
+        processed_text=processed_text,
+        dedupe_key=dedupe_key,
+    )
+    db.add(db_job)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    db.refresh(db_job)
+    return db_job
+
+def claim_quiz_report_job(db: Session, now: datetime.datetime) -> models.QuizReportJob | None:
+    """
+    실행할 때가 된 대기 작업 하나를 running으로 바꿔 가져옵니다. 여러 워커가 동시에 호출해도 한 곳만 가져갑니다.
+    """
+    job = models.QuizReportJob
+    while True:
+        db_job = (
+            db.query(job)
+            .filter(job.status == "pending", job.run_after <= now)
+            .order_by(job.id)
+            .first()
+        )
+        if db_job is None:
+            return None
+        claimed = (
+            db.query(job)
+            .filter(job.id == db_job.id, job.status == "pending")
+            .update({job.status: "running", job.attempts: job.attempts + 1, job.updated_at: now},
+                    synchronize_session=False)
+        )
+        db.commit()
+        if claimed:
+            db.refresh(db_job)
+            return db_job
+
+def finish_quiz_report_job(db: Session, job_id: int, status: str, result: str | None = None,
+                           error: str | None = None, run_after: datetime.datetime | None = None):
+    """
+    작업 결과를 기록합니다. status가 pending이면 run_after 이후에 다시 시도합니다.
+    """
+    values = {"status": status, "result": result, "error": error, "updated_at": datetime.datetime.utcnow()}
+    if run_after is not None:
+        values["run_after"] = run_after
+    db.query(models.QuizReportJob).filter(models.QuizReportJob.id == job_id).update(values, synchronize_session=False)
+    db.commit()
+
+def requeue_stale_quiz_report_jobs(db: Session, older_than: datetime.datetime) -> int:
+    """
+    처리 중에 워커가 죽어 running으로 남은 작업을 다시 대기 상태로 돌립니다.
+    """
+    job = models.QuizReportJob
+    count = (
+        db.query(job)
+        .filter(job.status == "running", job.updated_at < older_than)
+        .update({job.status: "pending"}, synchronize_session=False)
+    )
+    db.commit()
+    return count
+
+def get_quiz_report_job(db: Session, job_id: int):
+    return db.query(models.QuizReportJob).filter(models.QuizReportJob.id == job_id).first()
+
+def get_quiz_report_jobs(db: Session, user_id: int, limit: int = 20):
+    job = models.QuizReportJob
+    return db.query(job).filter(job.user_id == user_id).order_by(job.id.desc()).limit(limit).all()
+
+def rollup_bucket_start(created_at: datetime.datetime, period: str) -> datetime.datetime:
+    if period == "hour":
+        return created_at.replace(minute=0, second=0, microsecond=0)
+    return created_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _aggregate_rollups(messages) -> dict[tuple, list[int]]:
+    """
+    (scope, subject_id, period, bucket_start) -> [전체, 유해, 경험치 증감]
+    경험치 증감은 판정 규칙상의 값이며, 0에서 더 깎이지 않은 부분은 반영하지 않습니다.
+    """
+    counts = {}
+    for message in messages:
+        is_harmful = bool(message["is_harmful"])
+        xp_delta = status_delta(is_harmful)[0]
+        for scope, subject_id in (("user", message["owner_id"]), ("room", message["room_id"])):
+            for period in ROLLUP_PERIODS:
+                key = (scope, subject_id, period, rollup_bucket_start(message["created_at"], period))
+                entry = counts.setdefault(key, [0, 0, 0])
+                entry[0] += 1
+                entry[1] += is_harmful
+                entry[2] += xp_delta
+    return counts
+
+def add_message_rollups(db: Session, messages):
+    """
+    메시지들(owner_id, room_id, is_harmful, created_at)을 사용자/방별 시간·일 집계에 더합니다. (커밋은 호출자가)
+    """
+    counts = _aggregate_rollups(messages)
+    # 여러 워커가 같은 집계 행을 갱신해도 교착이 생기지 않도록 항상 같은 순서로 씁니다.
+    rows = [
+        {"scope": scope, "subject_id": subject_id, "period": period, "bucket_start": bucket_start,
+         "total": total, "harmful": harmful, "xp_delta": xp_delta}
+        for (scope, subject_id, period, bucket_start), (total, harmful, xp_delta) in sorted(counts.items())
+    ]
+    table = models.MessageRollup.__table__
+    dialect = db.get_bind().dialect.name
+    for start in range(0, len(rows), ROLLUP_UPSERT_CHUNK):
+        chunk = rows[start:start + ROLLUP_UPSERT_CHUNK]
+        if dialect == "mysql":
+            stmt = mysql.insert(table).values(chunk)
+            stmt = stmt.on_duplicate_key_update(
+                total=table.c.total + stmt.inserted.total,
+                harmful=table.c.harmful + stmt.inserted.harmful,
+                xp_delta=table.c.xp_delta + stmt.inserted.xp_delta,
+            )
+        else:
+            stmt = (postgresql.insert if dialect == "postgresql" else sqlite.insert)(table).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["scope", "subject_id", "period", "bucket_start"],
+                set_={
+                    "total": table.c.total + stmt.excluded.total,
+                    "harmful": table.c.harmful + stmt.excluded.harmful,
+                    "xp_delta": table.c.xp_delta + stmt.excluded.xp_delta,
+                },
+            )
+        db.execute(stmt)
+
+def get_message_rollups(db: Session, scope: str, subject_id: int, period: str,
+                        start: datetime.datetime, end: datetime.datetime):
+    """
+    [start, end) 구간의 집계 버킷을 시간순으로 반환합니다. 메시지가 없던 버킷은 행이 없습니다.
+    """
+    rollup = models.MessageRollup
+    return (
+        db.query(rollup)
+        .filter(
+            rollup.scope == scope,
+            rollup.subject_id == subject_id,
+            rollup.period == period,
+            rollup.bucket_start >= start,
+            rollup.bucket_start < end,
+        )
+        .order_by(rollup.bucket_start)
+        .all()
+    )
+
+def get_oldest_message_time(db: Session) -> datetime.datetime | None:
+    return db.execute(select(func.min(models.Message.created_at))).scalar()
+
+def get_archived_until(db: Session) -> datetime.datetime | None:
+    """
+    보관된 메시지 중 가장 늦은 created_at. 이 시각이 든 날짜까지는 messages에 일부만 남아 있습니다.
+    """
+    return db.execute(select(func.max(models.ArchiveSegment.last_created_at))).scalar()
+
+def rebuild_message_rollups(db: Session, start: datetime.datetime, end: datetime.datetime,
+                            batch_size: int = 5000) -> int:
+    """
+    [start, end) 구간의 집계를 지우고 messages에서 다시 계산해 커밋합니다. 센 메시지 수를 반환합니다.
+    시간/일 버킷이 구간에 딱 맞도록 start와 end는 UTC 자정이어야 합니다.
+    보관된 메시지가 있는 날짜는 messages에 일부만 남아 있어 집계를 잃으므로 거부합니다.
+    """
+    if rollup_bucket_start(start, "day") != start or rollup_bucket_start(end, "day") != end:
+        raise ValueError("start and end must be at midnight")
+    archived_until = get_archived_until(db)
+    if archived_until is not None and start <= archived_until:
+        raise ValueError(f"messages up to {archived_until} are archived; rollups before then cannot be rebuilt")
+    rollup = models.MessageRollup
+    db.query(rollup).filter(rollup.bucket_start >= start, rollup.bucket_start < end).delete(synchronize_session=False)
+    message = models.Message
+    counted, last_id = 0, 0
+    while True:
+        # 서버 측 커서 없이 id 순으로 끊어 읽어, 읽는 도중에도 같은 커넥션으로 집계를 쓸 수 있게 합니다.
+        rows = db.execute(
+            select(message.id, message.owner_id, message.room_id, message.is_harmful, message.created_at)
+            .where(message.id > last_id, message.created_at >= start, message.created_at < end)
+            .order_by(message.id)
+            .limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+        add_message_rollups(db, rows)
+        counted += len(rows)
+        last_id = rows[-1]["id"]
+    db.commit()
+    return counted
+
+def get_messages_older_than(db: Session, cutoff: datetime.datetime, limit: int):
+    """
+    cutoff 이전에 만들어진 메시지를 id 순으로 최대 limit개 반환합니다. (보관용)
+    """
+    message = models.Message
+    return db.query(message).filter(message.created_at < cutoff).order_by(message.id).limit(limit).all()
+
+def archive_messages(db: Session, segments: list[dict], message_ids: list[int]) -> bool:
+    """
+    세그먼트 색인을 추가하고 보관한 메시지를 지웁니다. 다른 워커가 먼저 보관했으면 False.
+    """
+    try:
+        db.execute(insert(models.ArchiveSegment), segments)
+        deleted = 0
+        for start in range(0, len(message_ids), 1000):
+            deleted += db.query(models.Message).filter(
+                models.Message.id.in_(message_ids[start:start + 1000])
+            ).delete(synchronize_session=False)
+    except IntegrityError:
+        db.rollback()
+        return False
+    if deleted != len(message_ids):
+        # 일부가 이미 다른 세그먼트로 옮겨졌으면 중복 색인이 생기지 않도록 되돌립니다.
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+def get_archive_segments(db: Session, room_id: int, before_id: int | None = None, after_id: int | None = None,
+                         limit: int = 8):
+    """
+    커서에 이어지는 방의 세그먼트. after_id면 오래된 것부터, 아니면 최근 것부터 최대 limit개.
+    """
+    segment = models.ArchiveSegment
+    query = db.query(segment).filter(segment.room_id == room_id)
+    if after_id is not None:
+        return query.filter(segment.last_id > after_id).order_by(segment.first_id.asc()).limit(limit).all()
+    if before_id is not None:
+        query = query.filter(segment.first_id < before_id)
+    return query.order_by(segment.last_id.desc()).limit(limit).all()
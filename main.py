@@ -1,32 +1,95 @@
-import json
+import asyncio
 import os
-from datetime import timedelta, datetime
+from contextlib import asynccontextmanager
+from datetime import timedelta, datetime, timezone
+from typing import Literal
 
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from websockets import InvalidParameterName
 from jose import JWTError, jwt
 
-import requests
+import httpx
 import ai_request
+import archive
+import chat_pipeline
 import crud
+import database
+import metrics
 import models
+import report_jobs
 import schemas
-from database import SessionLocal, engine
+import serialization
+import write_behind
+from auth_cache import principals, verified_tokens
+from broadcast_backend import create_backend
+from connections import ConnectionManager
+from database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from message_buffer import recent_messages
+from metrics import chat_stage_seconds, errors_total, websocket_connections_total
+from moderation_cache import moderation_cache
+from password_hashing import PasswordHasherBusy, password_hasher
+from prefilter import prefilter
+from rate_limit import (
+    RateLimited, chat_admission, client_ip, login_limiter, login_username_limiter, retry_after_header, signup_limiter
+)
+from resilience import CircuitOpenError, upstreams
+from story_cache import StoryCache
+from user_state import user_states
+from write_behind import message_writer
 
 AI_AGENT_API_URL = os.getenv("AI_AGENT_API_URL", "http://220.149.244.87:8000")
 KITTY_API_KEY = os.getenv("KITTY_API_KEY")
 QUIZ_REPORT_AI_API_URL = os.getenv("QUIZ_REPORT_AI_API_URL", "http://220.149.244.87:8000")
 QUIZ_REPORT_AI_API_KEY = os.getenv("QUIZ_REPORT_AI_API_KEY")
+STORY_API_TIMEOUT = float(os.getenv("STORY_API_TIMEOUT", "60"))
+QUIZ_REPORT_API_TIMEOUT = float(os.getenv("QUIZ_REPORT_API_TIMEOUT", "30"))
+# 0이면 토큰 없는 WebSocket도 받아 메시지의 sender_id를 그대로 씁니다. (예전 클라이언트 호환용)
+WS_AUTH_REQUIRED = os.getenv("WS_AUTH_REQUIRED", "1") == "1"
+# 1008: Policy Violation
+WS_POLICY_VIOLATION_CLOSE_CODE = 1008
+# /analytics 한 번에 돌려줄 수 있는 최대 버킷 수 (시간 단위 31일)
+ANALYTICS_MAX_BUCKETS = int(os.getenv("ANALYTICS_MAX_BUCKETS", "744"))
+ROLLUP_PERIOD_LENGTHS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+# 구간을 주지 않았을 때 보여 줄 최근 기간
+ANALYTICS_DEFAULT_SPANS = {"hour": timedelta(hours=24), "day": timedelta(days=7)}
 
 models.Base.metadata.create_all(bind=engine)
+# create_all은 이미 있는 테이블에 새 인덱스를 만들지 않으므로 따로 확인합니다.
+for table in models.Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await message_writer.start()
+    await manager.start()
+    await quiz_reports.start()
+    await archive.message_archiver.start()
+    if KITTY_API_KEY:
+        await story_cache.start()
+    yield
+    await story_cache.close()
+    await archive.message_archiver.close()
+    # 파이프라인에 남은 메시지를 먼저 처리/저장한 뒤 커넥션 풀 정리
+    await pipeline.close()
+    await quiz_reports.close()
+    await message_writer.close()
+    await ai_request.close_client()
+    await manager.stop()
+    await async_engine.dispose()
+    moderation_cache.close()
+    password_hasher.close()
 
 app = FastAPI(
     title="Kitty App API",
     version="0.1.0",
     description="API for the Kitty App, a chat application with AI-powered content moderation.",
+    lifespan=lifespan,
 )
 
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -40,29 +103,32 @@ app.add_middleware(
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Next-Before-Id", "X-Next-After-Id"]
 )
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: dict[int, list[WebSocket]] = {}
-
-    async def connect(self, websocket: WebSocket, room_id: int):
-        await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        self.active_connections[room_id].append(websocket)
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many login requests, please retry shortly"},
+        headers={"Retry-After": "1"},
+    )
 
-    def disconnect(self, websocket: WebSocket, room_id: int):
-        if room_id in self.active_connections:
-            self.active_connections[room_id].remove(websocket)
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests, please retry later", "scope": exc.scope},
+        headers={"Retry-After": retry_after_header(exc.retry_after)},
+    )
 
-    async def broadcast(self, message: str, room_id: int):
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]:
-                await connection.send_text(message)
+def client_address(request: Request) -> str:
+    # AUTH_TRUSTED_PROXIES 뒤에서는 X-Forwarded-For의 클라이언트 주소를 씁니다.
+    peer = request.client.host if request.client else "unknown"
+    return client_ip(peer, request.headers.get("x-forwarded-for"))
 
-manager = ConnectionManager()
+manager = ConnectionManager(backend=create_backend(), history=recent_messages)
 
 def get_db():
     db = SessionLocal()
@@ -71,6 +137,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -81,6 +151,19 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def verify_token(token: str) -> str:
+    """
+    토큰을 검증하고 username(sub)을 반환합니다. 한 번 검증한 토큰은 exp까지 다시 디코딩하지 않습니다.
+    """
+    claims = verified_tokens.get_claims(token)
+    if claims is None:
+        claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        verified_tokens.remember(token, claims)
+    username = claims.get("sub")
+    if username is None:
+        raise JWTError("Token has no subject")
+    return username
+
 def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=401,
@@ -88,30 +171,69 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
+        username = verify_token(token)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=username)
+    user = principals.get(username)
     if user is None:
-        raise credentials_exception
+        db_user = crud.get_user_by_username(db, username=username)
+        if db_user is None:
+            raise credentials_exception
+        user = schemas.User.from_orm(db_user)
+        principals.remember(username, user)
+    return user
+
+async def authenticate_websocket(websocket: WebSocket) -> schemas.User | None:
+    """
+    ?token= 또는 Authorization: Bearer 헤더의 토큰으로 WebSocket 사용자를 확인합니다.
+    토큰이 없거나 유효하지 않으면 None.
+    """
+    token = websocket.query_params.get("token")
+    if token is None:
+        scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    if not token:
+        return None
+    try:
+        username = verify_token(token)
+    except JWTError:
+        return None
+    user = principals.get(username)
+    if user is None:
+        async with AsyncSessionLocal() as db:
+            db_user = await db.run_sync(crud.get_user_by_username, username=username)
+            if db_user is None:
+                return None
+            user = schemas.User.from_orm(db_user)
+        principals.remember(username, user)
     return user
 
 @app.post("/token")
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not crud.pwd_context.verify(form_data.password, user.hashed_password):
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(),
+                                 db: AsyncSession = Depends(get_async_db)):
+    # 비밀번호 대입이나 로그인 폭주가 bcrypt 풀을 다 차지하지 않도록 IP별, 사용자 이름별로 제한합니다. (429)
+    login_limiter.check(client_address(request))
+    login_username_limiter.check(form_data.username)
+    user = await db.run_sync(crud.get_user_by_username, username=form_data.username)
+    verified, new_hash = False, None
+    if user:
+        # bcrypt 검증은 전용 풀에서 실행합니다. 풀이 밀려 있으면 PasswordHasherBusy(503)
+        verified, new_hash = await password_hasher.verify(form_data.password, user.hashed_password)
+    if not verified:
         raise HTTPException(
             status_code=401,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # 해시 설정(cost)이 바뀌었으면 새 설정으로 다시 저장합니다.
+        await db.run_sync(crud.update_password_hash, user_id=user.id, hashed_password=new_hash)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
+    # 다시 로그인하면 프로필을 DB에서 새로 읽습니다.
+    principals.invalidate(user.username)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/generate-story", response_model=schemas.StoryGenerationResponse)
@@ -119,20 +241,28 @@ async def generate_story(request: schemas.RiskScoreRequest):
     if not KITTY_API_KEY:
         raise HTTPException(status_code=500, detail="KITTY_API_KEY not configured")
 
+    try:
+        # 같은 risk_score의 동시 요청은 업스트림 호출 하나를 공유하고, 결과는 잠시 재사용합니다.
+        return await story_cache.get(request.risk_score)
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="AI agent API is unavailable", headers={"Retry-After": "10"})
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"AI agent API call failed: {e}")
+
+async def fetch_story(risk_score: int) -> schemas.StoryGenerationResponse:
     headers = {
         "Content-Type": "application/json",
         "x-api-key": KITTY_API_KEY
     }
     payload = {
-        "risk_score": request.risk_score
+        "risk_score": risk_score
     }
+    data = await ai_request.post_json(
+        f"{AI_AGENT_API_URL}/generate-story", payload, headers=headers, timeout=STORY_API_TIMEOUT, upstream="story"
+    )
+    return schemas.StoryGenerationResponse(**data)
 
-    try:
-        response = requests.post(f"{AI_AGENT_API_URL}/generate-story", headers=headers, json=payload)
-        response.raise_for_status()  # Raise an exception for HTTP errors (4xx or 5xx)
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"AI agent API call failed: {e}")
+story_cache = StoryCache(fetch=fetch_story)
 
 async def call_quiz_report_ai_server(user_id: int, original_text: str, processed_text: str) -> schemas.ProcessChatDataResponse:
     if not QUIZ_REPORT_AI_API_KEY:
@@ -149,31 +279,79 @@ async def call_quiz_report_ai_server(user_id: int, original_text: str, processed
     }
 
     try:
-        response = requests.post(f"{QUIZ_REPORT_AI_API_URL}/process_chat_data", headers=headers, json=payload)
-        response.raise_for_status()
-        return schemas.ProcessChatDataResponse(**response.json())
-    except requests.exceptions.RequestException as e:
+        data = await ai_request.post_json(
+            f"{QUIZ_REPORT_AI_API_URL}/process_chat_data", payload, headers=headers, timeout=QUIZ_REPORT_API_TIMEOUT,
+            upstream="quiz_report"
+        )
+        return schemas.ProcessChatDataResponse(**data)
+    except httpx.HTTPError as e:
         print(f"Error calling Quiz/Report AI server: {e}")
-        if response is not None:
-            print(f"Response status: {response.status_code}, body: {response.text}")
+        if isinstance(e, httpx.HTTPStatusError):
+            print(f"Response status: {e.response.status_code}, body: {e.response.text}")
         raise HTTPException(status_code=500, detail=f"Quiz/Report AI server call failed: {e}")
 
+async def push_quiz_report(job: schemas.QuizReportJob):
+    if job.room_id is None:
+        return
+    await manager.broadcast(
+        {"type": "quiz_report", "recipient_id": job.user_id, "job": job},
+        room_id=job.room_id
+    )
+
+quiz_reports = report_jobs.QuizReportQueue(generate=call_quiz_report_ai_server, deliver=push_quiz_report)
+
+pipeline = chat_pipeline.ChatPipeline(broadcast=manager.broadcast, quiz_report=quiz_reports.enqueue)
+
+# /metrics 수집 시점에 각 컴포넌트의 stats()를 게이지로 내보냅니다.
+metrics.registry.register_stats("connections", manager.stats)
+metrics.registry.register_stats("chat_pipeline", pipeline.stats)
+metrics.registry.register_stats("recent_messages", recent_messages.stats)
+metrics.registry.register_stats("write_behind", message_writer.stats)
+metrics.registry.register_stats("user_states", user_states.stats)
+metrics.registry.register_stats("quiz_reports", quiz_reports.stats)
+metrics.registry.register_stats("story_cache", story_cache.stats)
+metrics.registry.register_stats("prefilter", prefilter.stats)
+metrics.registry.register_stats("moderation_cache", moderation_cache.stats)
+metrics.registry.register_stats("moderation_batcher", ai_request.moderation_batcher.stats)
+metrics.registry.register_stats("token_cache", verified_tokens.stats)
+metrics.registry.register_stats("principal_cache", principals.stats)
+metrics.registry.register_stats("password_hasher", password_hasher.stats)
+metrics.registry.register_stats("ai_http", ai_request.stats)
+metrics.registry.register_stats("chat_admission", chat_admission.stats)
+metrics.registry.register_stats("archive", archive.message_archiver.stats)
+metrics.registry.register_stats("auth_rate_limit", login_limiter.stats, endpoint="token", key="ip")
+metrics.registry.register_stats("auth_rate_limit", login_username_limiter.stats, endpoint="token", key="username")
+metrics.registry.register_stats("auth_rate_limit", signup_limiter.stats, endpoint="users", key="ip")
+for name, upstream in upstreams.items():
+    metrics.registry.register_stats("upstream", upstream.stats, upstream=name)
+metrics.registry.register_stats("db_pool", lambda: database.pool_stats(engine), engine="sync")
+metrics.registry.register_stats("db_pool", lambda: database.pool_stats(async_engine.sync_engine), engine="async")
+
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def create_user(request: Request, user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    signup_limiter.check(client_address(request))
+    db_user = await db.run_sync(crud.get_user_by_username, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    db_user = crud.get_user_by_phone_number(db, phone_number=user.phone_number)
+    db_user = await db.run_sync(crud.get_user_by_phone_number, phone_number=user.phone_number)
     if db_user:
         raise HTTPException(status_code=400, detail="Phone number already registered")
     if user.email:
-        db_user = crud.get_user_by_email(db, email=user.email)
+        db_user = await db.run_sync(crud.get_user_by_email, email=user.email)
         if db_user:
             raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = await password_hasher.hash(user.password)
+    return await db.run_sync(crud.create_user, user=user, hashed_password=hashed_password)
 
 @app.get("/users/me", response_model=schemas.User)
 def read_users_me(current_user: schemas.User = Depends(get_current_user)):
+    # 캐시된 사용자 정보의 경험치/상태는 채팅 중에 바뀌므로 최신 값으로 덮어씁니다.
+    status = user_states.peek(current_user.id)
+    if status is not None:
+        xp, state, harmful_chat_count = status
+        return current_user.model_copy(update={
+            "experience_points": xp, "character_state": state, "harmful_chat_count": harmful_chat_count
+        })
     return current_user
 
 @app.post("/ai-story", response_model=schemas.DiaryGenerationResponse)
@@ -204,7 +382,7 @@ async def generate_ai_story(request: schemas.DiaryEntryRequest):
         raise HTTPException(status_code=500, detail=f"Failed to generate AI story: {e}")
 
 @app.get("/users/", response_model=list[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_users(skip: int = 0, limit: int = Query(100, ge=1, le=500), db: Session = Depends(get_db)):
     users = crud.get_users(db, skip=skip, limit=limit)
     return users
 
@@ -219,79 +397,223 @@ def read_user(user_id: int, db: Session = Depends(get_db)):
 def create_room(room: schemas.RoomCreate, db: Session = Depends(get_db)):
     return crud.create_room(db=db, room=room)
 
-@app.get("/rooms/", response_model=list[schemas.Room])
-def read_rooms(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    rooms = crud.get_rooms(db, skip=skip, limit=limit)
-    return rooms
+@app.get("/rooms/", response_model=list[schemas.RoomSummary])
+def read_rooms(skip: int = 0, limit: int = Query(100, ge=1, le=500), db: Session = Depends(get_db)):
+    return crud.get_room_summaries(db, skip=skip, limit=limit)
 
 @app.get("/messages/{room_id}", response_model=list[schemas.Message])
-def read_messages(room_id: int, db: Session = Depends(get_db)):
-    messages = crud.get_messages(db, room_id=room_id)
+async def read_messages(
+    room_id: int,
+    response: Response,
+    before_id: int | None = None,
+    after_id: int | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Use either before_id or after_id, not both")
+    messages = None
+    if manager.tracks(room_id):
+        # 최근 기록은 메모리 버퍼에서, 버퍼로 답할 수 없는 오래된 페이지만 DB에서 읽습니다.
+        messages = await recent_messages.page(room_id, before_id=before_id, after_id=after_id, limit=limit)
+    if messages is None:
+        # 최근 기록(DB)으로 모자라면 보관된 세그먼트를 같은 커서로 이어서 읽습니다.
+        messages = [
+            message.model_dump(mode="json")
+            for message in await archive.get_messages(
+                db, room_id=room_id, before_id=before_id, after_id=after_id, limit=limit
+            )
+        ]
+    # 다음 페이지 커서: 이전 기록은 X-Next-Before-Id, 새 메시지는 X-Next-After-Id
+    if after_id is None and len(messages) == limit:
+        response.headers["X-Next-Before-Id"] = str(messages[0]["id"])
+    if messages:
+        response.headers["X-Next-After-Id"] = str(messages[-1]["id"])
+    elif after_id is not None:
+        response.headers["X-Next-After-Id"] = str(after_id)
     return messages
 
+@app.get("/quiz-reports/{job_id}", response_model=schemas.QuizReportJob)
+async def read_quiz_report(job_id: int, current_user: schemas.User = Depends(get_current_user),
+                           db: AsyncSession = Depends(get_async_db)):
+    job = await db.run_sync(crud.get_quiz_report_job, job_id=job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Quiz report not found")
+    return report_jobs.job_to_schema(job)
+
+@app.get("/users/me/quiz-reports", response_model=list[schemas.QuizReportJob])
+async def read_my_quiz_reports(limit: int = Query(20, ge=1, le=100), current_user: schemas.User = Depends(get_current_user),
+                               db: AsyncSession = Depends(get_async_db)):
+    jobs = await db.run_sync(crud.get_quiz_report_jobs, user_id=current_user.id, limit=limit)
+    return [report_jobs.job_to_schema(job) for job in jobs]
+
+def _to_utc(value: datetime) -> datetime:
+    # 집계 버킷은 UTC 기준의 naive datetime으로 저장됩니다.
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+async def read_message_rollups(db: AsyncSession, scope: str, subject_id: int, period: str,
+                               start: datetime | None, end: datetime | None) -> schemas.MessageRollupSummary:
+    length = ROLLUP_PERIOD_LENGTHS[period]
+    # end는 그 시각이 속한 버킷까지 포함하도록 올림, start는 내림합니다.
+    end = crud.rollup_bucket_start(_to_utc(end) if end else datetime.utcnow(), period) + length
+    start = crud.rollup_bucket_start(_to_utc(start), period) if start else end - ANALYTICS_DEFAULT_SPANS[period]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - start) / length > ANALYTICS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range too large (max {ANALYTICS_MAX_BUCKETS} {period} buckets)")
+    buckets = [
+        schemas.MessageRollup.from_orm(rollup)
+        for rollup in await db.run_sync(
+            crud.get_message_rollups, scope=scope, subject_id=subject_id, period=period, start=start, end=end
+        )
+    ]
+    return schemas.MessageRollupSummary(
+        scope=scope,
+        subject_id=subject_id,
+        period=period,
+        start=start,
+        end=end,
+        total=sum(bucket.total for bucket in buckets),
+        harmful=sum(bucket.harmful for bucket in buckets),
+        xp_delta=sum(bucket.xp_delta for bucket in buckets),
+        buckets=buckets,
+    )
+
+@app.get("/analytics/users/{user_id}", response_model=schemas.MessageRollupSummary)
+async def read_user_analytics(user_id: int, period: Literal["hour", "day"] = "day", start: datetime | None = None,
+                              end: datetime | None = None, current_user: schemas.User = Depends(get_current_user),
+                              db: AsyncSession = Depends(get_async_db)):
+    # 사용자별 활동은 본인만 볼 수 있습니다.
+    if current_user.id != user_id:
+        raise HTTPException(status_code=403, detail="Not allowed to read another user's analytics")
+    # 미리 집계된 행만 읽으므로 messages 테이블을 훑지 않습니다.
+    return await read_message_rollups(db, "user", user_id, period, start, end)
+
+@app.get("/analytics/rooms/{room_id}", response_model=schemas.MessageRollupSummary)
+async def read_room_analytics(room_id: int, period: Literal["hour", "day"] = "day", start: datetime | None = None,
+                              end: datetime | None = None, current_user: schemas.User = Depends(get_current_user),
+                              db: AsyncSession = Depends(get_async_db)):
+    return await read_message_rollups(db, "room", room_id, period, start, end)
+
+# 통계/지표는 이벤트 루프에서 읽습니다. 스레드풀에서 읽으면 루프가 바꾸는 dict를 순회하다 실패할 수 있습니다.
+@app.get("/moderation/stats")
+async def read_moderation_stats():
+    return {
+        "prefilter": prefilter.stats(),
+        "cache": moderation_cache.stats(),
+        "batcher": ai_request.moderation_batcher.stats(),
+    }
+
+@app.get("/chat/stats")
+async def read_chat_stats():
+    return {
+        "connections": manager.stats(),
+        "pipeline": pipeline.stats(),
+        "recent_messages": recent_messages.stats(),
+        "write_behind": message_writer.stats(),
+        "user_states": user_states.stats(),
+        "quiz_reports": quiz_reports.stats(),
+        "admission": chat_admission.stats(),
+        "archive": archive.message_archiver.stats(),
+    }
+
+@app.get("/upstreams/stats")
+async def read_upstream_stats():
+    return {name: upstream.stats() for name, upstream in upstreams.items()}
+
+@app.get("/story/stats")
+async def read_story_stats():
+    return story_cache.stats()
+
+@app.get("/auth/stats")
+async def read_auth_stats():
+    return {
+        "verified_tokens": verified_tokens.stats(),
+        "principals": principals.stats(),
+        "password_hasher": password_hasher.stats(),
+        "login_limiter": login_limiter.stats(),
+        "login_username_limiter": login_username_limiter.stats(),
+        "signup_limiter": signup_limiter.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.websocket("/ws/{room_id}")
 async def websocket_endpoint(websocket: WebSocket, room_id: int):
-    await manager.connect(websocket, room_id)
+    # 연결할 때 한 번만 인증하고, 이후 메시지의 보낸 사람은 인증된 사용자로 고정합니다.
+    principal = await authenticate_websocket(websocket)
+    if principal is None and WS_AUTH_REQUIRED:
+        websocket_connections_total.inc(result="rejected")
+        await websocket.close(code=WS_POLICY_VIOLATION_CLOSE_CODE)
+        return
+    websocket_connections_total.inc(result="accepted")
+    connection = await manager.connect(websocket, room_id, principal.id if principal is not None else None)
+    # 연결 하나당 세션 하나를 두고 메시지마다 재사용합니다.
+    db = AsyncSessionLocal()
     try:
         while True:
-            data = await websocket.receive_text()
-            parsed = json.loads(data)
+            parsed = await serialization.receive_json(websocket, connection.format)
 
             if parsed.get("type") == "join_room":
+                # 방 입장 시 최근 기록을 이 소켓에만 보내 줍니다.
+                await manager.send(connection, {
+                    "type": "history",
+                    "room_id": room_id,
+                    "messages": await recent_messages.latest(room_id),
+                })
                 continue
 
-            db: Session = SessionLocal()
-
             content = parsed["content"]
-            sender_id = parsed["sender_id"]
+            sender_id = principal.id if principal is not None else parsed["sender_id"]
+
+            # 유해성 판단 전에 보낸 사람/방/전체 한도를 확인합니다. 넘치면 알리고 늦추거나 버립니다.
+            try:
+                delay, limiting_scope = chat_admission.admit(sender_id, room_id)
+            except RateLimited as e:
+                await manager.send(connection, {
+                    "type": "rate_limited",
+                    "scope": e.scope,
+                    "retry_after": round(e.retry_after, 3),
+                    "dropped": True,
+                    "content": content,
+                })
+                continue
+            if delay > 0:
+                await manager.send(connection, {
+                    "type": "rate_limited",
+                    "scope": limiting_scope,
+                    "retry_after": round(delay, 3),
+                    "dropped": False,
+                })
+                # 기다리는 동안 이 소켓에서 더 읽지 않으므로 클라이언트 쪽에도 자연히 배압이 걸립니다.
+                await asyncio.sleep(delay)
+
+            if chat_pipeline.CHAT_PIPELINE_ENABLED:
+                # 판정/브로드캐스트/저장은 파이프라인 워커가 처리합니다.
+                await pipeline.submit(room_id, sender_id, content)
+                continue
 
-            ai_result = ai_request.process_text_with_ai(content)
+            with chat_stage_seconds.time(path="inline", stage="moderation"):
+                ai_result = await ai_request.process_text_with_ai(content)
             is_harmful = ai_result.get("is_harmful", False)
             purified_text = ai_result.get("purified_text", content)
             harmful_words = ai_result.get("harmful_words", [])
             quiz_results = ai_result.get("quiz_results", [])
             report_results = ai_result.get("report_results", {})
 
-            user = crud.get_user(db, user_id=sender_id)
-            if not user:
-                raise InvalidParameterName("User not found")
-
             # 3. 결과에 따라 경험치 및 캐릭터 상태 업데이트
-            new_harmful_chat_count = user.harmful_chat_count
-            quiz_results_from_ai = []
-            report_results_from_ai = {}
-
-            if is_harmful:
-                new_xp = user.experience_points - 10
-                new_state = "crying"
-                new_harmful_chat_count += 1
-
-                # Check if harmful_chat_count reaches 10 or more
-                if new_harmful_chat_count >= 10:
-                    try:
-                        # Call the Quiz/Report AI server
-                        ai_response = await call_quiz_report_ai_server(
-                            user_id=sender_id,
-                            original_text=content,
-                            processed_text=ai_result.get("raw_processed_text_from_ai_server", "")
-                        )
-                        quiz_results_from_ai = ai_response.quiz_results
-                        report_results_from_ai = ai_response.report_results
-                    except HTTPException as e:
-                        print(f"Failed to get quiz/report from AI server: {e.detail}")
-
-            else:
-                new_xp = user.experience_points + 5
-                new_state = "smiling"
-
-            # 경험치는 0 미만으로 내려가지 않도록 방지
-            if new_xp < 0:
-                new_xp = 0
-
-            updated_user = crud.update_user_status(
-                db, user_id=user.id, xp=new_xp, character_state=new_state, harmful_chat_count=new_harmful_chat_count
-            )
-
+            # 사용자별로 순서대로 적용되며, write-behind가 아니면 DB에서 바로 원자적으로 증감합니다.
+            with chat_stage_seconds.time(path="inline", stage="user_update"):
+                status = await user_states.apply(
+                    sender_id, is_harmful, write_through=not write_behind.WRITE_BEHIND_ENABLED, db=db
+                )
+            if status is None:
+                raise InvalidParameterName("User not found")
+            new_xp, new_state, new_harmful_chat_count = status
             try:
                 message_create = schemas.MessageCreate(
                     room_id=room_id,
@@ -301,30 +623,54 @@ async def websocket_endpoint(websocket: WebSocket, room_id: int):
                     experience_points=new_xp, # 메시지 자체의 경험치
                     is_harmful=is_harmful,
                 )
-                db_message = crud.create_message(db, message_create)
-                schema_data = schemas.Message.from_orm(db_message)
-                from fastapi.encoders import jsonable_encoder
+                with chat_stage_seconds.time(path="inline", stage="message_insert"):
+                    if write_behind.WRITE_BEHIND_ENABLED:
+                        # 사용자 상태와 메시지는 write-behind 버퍼가 모아서 한 번에 저장합니다.
+                        try:
+                            schema_data = await message_writer.add_message(message_create, status)
+                        finally:
+                            user_states.settle(sender_id, status)
+                    else:
+                        db_message = await db.run_sync(crud.create_message, message_create)
+                        schema_data = schemas.Message.from_orm(db_message)
 
                 # 사용자 정보 업데이트를 포함하여 브로드캐스트
-                await manager.broadcast(
-                    json.dumps({
-                        "type": "new_message",
-                        "message": jsonable_encoder(schema_data),
-                        "user_update": {
-                            "id": updated_user.id,
-                            "experience_points": updated_user.experience_points,
-                            "character_state": updated_user.character_state,
-                            "harmful_chat_count": updated_user.harmful_chat_count
+                with chat_stage_seconds.time(path="inline", stage="broadcast"):
+                    await manager.broadcast(
+                        {
+                            "type": "new_message",
+                            "message": schema_data,
+                            "user_update": {
+                                "id": sender_id,
+                                "experience_points": new_xp,
+                                "character_state": new_state,
+                                "harmful_chat_count": new_harmful_chat_count
+                            },
+                            # 퀴즈/리포트는 작업 큐가 만들어 quiz_report 이벤트로 따로 보냅니다.
+                            "quiz_results": [],
+                            "report_results": {}
                         },
-                        "quiz_results": quiz_results_from_ai,
-                        "report_results": report_results_from_ai
-                    }),
-                    room_id=room_id
-                )
+                        room_id=room_id
+                    )
+
+                # Check if harmful_chat_count reaches 10 or more
+                if is_harmful and new_harmful_chat_count >= chat_pipeline.QUIZ_REPORT_THRESHOLD:
+                    await quiz_reports.enqueue(
+                        user_id=sender_id,
+                        room_id=room_id,
+                        original_text=content,
+                        processed_text=ai_result.get("raw_processed_text_from_ai_server", "")
+                    )
             except Exception as e:
+                errors_total.inc(component="websocket")
                 print("Error:", e)
+                await db.rollback()
             finally:
-                db.close()
+                # 커넥션을 풀에 돌려주고 식별자 맵을 비웁니다. 세션 객체는 계속 사용합니다.
+                await db.close()
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket, room_id)
\ No newline at end of file
+        pass
+    finally:
+        manager.disconnect(websocket, room_id)
+        await db.close()
\ No newline at end of file
@@ -0,0 +1,165 @@
+import asyncio
+import bisect
+import os
+from collections import OrderedDict, deque
+
+
+import archive
+import crud
+from database import AsyncSessionLocal
+
+# 방마다 메모리에 들고 있는 최근 메시지 수
+MESSAGE_BUFFER_SIZE = int(os.getenv("MESSAGE_BUFFER_SIZE", "100"))
+# 버퍼를 유지할 최대 방 수. 넘치면 가장 오래 안 쓰인 방부터 비웁니다.
+MESSAGE_BUFFER_MAX_ROOMS = int(os.getenv("MESSAGE_BUFFER_MAX_ROOMS", "1000"))
+
+
+class _RoomBuffer:
+    __slots__ = ("messages", "complete")
+
+    def __init__(self, messages: list[dict], size: int, complete: bool):
+        self.messages: deque[dict] = deque(messages, maxlen=size)
+        # 방의 전체 기록이 버퍼 안에 다 들어 있는지 여부
+        self.complete = complete
+
+
+def _insert(buffer: _RoomBuffer, message: dict, size: int):
+    # 워커가 여럿이면 브로드캐스트 백엔드를 거쳐 id 순서가 뒤바뀌어 올 수 있으므로 id 순서 자리에 넣습니다.
+    messages = buffer.messages
+    message_id = message["id"]
+    if not messages or message_id > messages[-1]["id"]:
+        position = len(messages)
+    else:
+        position = bisect.bisect_left(messages, message_id, key=lambda m: m["id"])
+        if position < len(messages) and messages[position]["id"] == message_id:
+            return
+        if position == 0 and len(messages) == size:
+            # 버퍼의 가장 오래된 메시지보다 오래되었으므로 담을 자리가 없습니다.
+            buffer.complete = False
+            return
+    if len(messages) == size:
+        messages.popleft()
+        position -= 1
+        buffer.complete = False
+    messages.insert(position, message)
+
+
+async def _load_latest(room_id: int, limit: int) -> tuple[list[dict], bool]:
+    """
+    최신 메시지와 함께, 그것이 방의 전체 기록인지를 돌려줍니다.
+    최근 기록이 적은 방은 보관된 메시지까지 읽어야 "전체 기록이 버퍼에 있다"고 판단할 수 있습니다.
+    """
+    async with AsyncSessionLocal() as db:
+        messages = [
+            message.model_dump(mode="json")
+            for message in await archive.get_messages(db, room_id=room_id, limit=limit)
+        ]
+        complete = len(messages) < limit
+        if complete and messages:
+            # 가장 오래된 메시지보다 앞선 세그먼트가 남아 있으면 전체 기록이 아닙니다.
+            complete = not await db.run_sync(
+                crud.get_archive_segments, room_id=room_id, before_id=messages[0]["id"], limit=1
+            )
+        return messages, complete
+
+
+class RecentMessageBuffer:
+    """
+    방별 최근 메시지 링 버퍼. 저장된 메시지를 쓰기 시점에 채우고,
+    처음 읽을 때 DB에서 최신 메시지를 불러와 데웁니다.
+    """
+
+    def __init__(self, size: int = MESSAGE_BUFFER_SIZE, max_rooms: int = MESSAGE_BUFFER_MAX_ROOMS):
+        self.size = size
+        self.max_rooms = max_rooms
+        self._rooms: OrderedDict[int, _RoomBuffer] = OrderedDict()
+        # 데우는 중인 방: 그 사이에 저장된 메시지를 모아 뒀다가 합칩니다.
+        self._loading: dict[int, tuple[asyncio.Future, list[dict]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def append(self, room_id: int, message: dict):
+        """
+        DB에 저장된(id가 있는) 메시지를 버퍼에 추가합니다. 데워지지 않은 방은 건너뜁니다.
+        """
+        buffer = self._rooms.get(room_id)
+        if buffer is not None:
+            _insert(buffer, message, self.size)
+            self._rooms.move_to_end(room_id)
+        elif room_id in self._loading:
+            self._loading[room_id][1].append(message)
+
+    async def _get(self, room_id: int) -> _RoomBuffer:
+        buffer = self._rooms.get(room_id)
+        if buffer is not None:
+            self.hits += 1
+            self._rooms.move_to_end(room_id)
+            return buffer
+
+        loading = self._loading.get(room_id)
+        if loading is not None:
+            return await asyncio.shield(loading[0])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        pending: list[dict] = []
+        self._loading[room_id] = (future, pending)
+        try:
+            messages, complete = await _load_latest(room_id, self.size)
+        except Exception as e:
+            del self._loading[room_id]
+            future.set_exception(e)
+            # 기다리는 쪽이 없어도 "never retrieved" 경고가 나지 않도록 표시합니다.
+            future.exception()
+            raise
+        del self._loading[room_id]
+
+        by_id = {message["id"]: message for message in messages + pending}
+        merged = [by_id[message_id] for message_id in sorted(by_id)]
+        buffer = _RoomBuffer(merged[-self.size:], self.size, complete=complete and len(merged) < self.size)
+        self._rooms[room_id] = buffer
+        while len(self._rooms) > self.max_rooms:
+            self._rooms.popitem(last=False)
+        future.set_result(buffer)
+        return buffer
+
+    async def latest(self, room_id: int) -> list[dict]:
+        return list((await self._get(room_id)).messages)
+
+    async def page(self, room_id: int, before_id: int | None = None, after_id: int | None = None,
+                   limit: int = MESSAGE_BUFFER_SIZE) -> list[dict] | None:
+        """
+        crud.get_messages와 같은 페이지를 버퍼에서 만듭니다. 버퍼로 답할 수 없으면 None.
+        """
+        if limit > self.size:
+            return None
+        buffer = await self._get(room_id)
+        messages = buffer.messages
+        if after_id is not None:
+            # 버퍼는 가장 오래된 항목 이후의 방 메시지를 모두 담고 있습니다.
+            if not buffer.complete and after_id < messages[0]["id"]:
+                return None
+            return [m for m in messages if m["id"] > after_id][:limit]
+        if before_id is not None:
+            older = [m for m in messages if m["id"] < before_id]
+            if len(older) < limit and not buffer.complete:
+                return None
+            return older[-limit:]
+        return list(messages)[-limit:]
+
+    def evict(self, room_id: int):
+        self._rooms.pop(room_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "rooms": len(self._rooms),
+            "max_rooms": self.max_rooms,
+            "messages": sum(len(buffer.messages) for buffer in self._rooms.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+recent_messages = RecentMessageBuffer()
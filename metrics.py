@@ -0,0 +1,174 @@
+"""
+Prometheus 텍스트 형식(/metrics)으로 내보내는 가벼운 계측.
+
+히스토그램 관측은 bisect 한 번과 덧셈 몇 번이라 부하 중에도 켜 두어도 됩니다.
+각 컴포넌트의 stats()는 수집 시점에만 호출되어 게이지로 변환됩니다.
+값은 프로세스(워커)별입니다.
+"""
+import time
+from bisect import bisect_left
+
+METRIC_PREFIX = "kitty_"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # 라벨 값 -> [버킷별 개수(+Inf 포함, 누적 아님), 합계, 개수]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self._values[key] = entry
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def time(self, **labels) -> _Timer:
+        """
+        with 블록의 실행 시간을 관측합니다.
+        """
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+        # (컴포넌트 이름, stats 함수, 고정 라벨)
+        self._stats: list[tuple[str, object, dict]] = []
+
+    def counter(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, component: str, stats, **labels):
+        """
+        stats()가 돌려주는 숫자 값들을 kitty_<component>_<key> 게이지로 내보냅니다.
+        """
+        self._stats.append((component, stats, labels))
+
+    def _render_stats(self) -> list[str]:
+        samples: dict[str, list[str]] = {}
+        for component, stats, labels in self._stats:
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"Metrics collection for {component} failed: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"{METRIC_PREFIX}{component}_{key}"
+                samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        lines = []
+        for name, metric_lines in samples.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(metric_lines)
+        return lines
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.extend(self._render_stats())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# 채팅 경로 단계별 시간 (receive | moderation | user_update | message_insert | broadcast)
+chat_stage_seconds = registry.histogram(
+    "chat_stage_seconds", "Time spent in each stage of handling a chat message", ("path", "stage")
+)
+upstream_request_seconds = registry.histogram(
+    "upstream_request_seconds", "Latency of AI upstream calls", ("upstream", "outcome")
+)
+upstream_errors_total = registry.counter(
+    "upstream_errors_total", "Failed AI upstream calls by error type", ("upstream", "error")
+)
+errors_total = registry.counter("errors_total", "Unexpected errors by component", ("component",))
+websocket_connections_total = registry.counter(
+    "websocket_connections_total", "WebSocket connection attempts by result", ("result",)
+)
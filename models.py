@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Index, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 from database import Base
 import datetime
@@ -18,7 +18,8 @@ class User(Base):
     character_state = Column(String(255), default="smiling")
     harmful_chat_count = Column(Integer, default=0)
 
-    messages = relationship("Message", back_populates="owner")
+    # 메시지 목록은 항상 명시적인 쿼리로 읽습니다. (전체 기록 지연 로딩 방지)
+    messages = relationship("Message", back_populates="owner", lazy="raise")
 
 class Room(Base):
     __tablename__ = "rooms"
@@ -26,10 +27,14 @@ class Room(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(255), index=True)
 
-    messages = relationship("Message", back_populates="room")
+    messages = relationship("Message", back_populates="room", lazy="raise")
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        # 방별 키셋 페이지네이션 (room_id = ? AND id < ? ORDER BY id DESC)
+        Index("ix_messages_room_id_id", "room_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(String(255))
@@ -42,3 +47,80 @@ class Message(Base):
 
     owner = relationship("User", back_populates="messages")
     room = relationship("Room", back_populates="messages")
+
+class IdBlock(Base):
+    """
+    애플리케이션이 미리 예약해 쓰는 id 구간의 다음 시작값 (write-behind 메시지 저장용)
+    """
+    __tablename__ = "id_blocks"
+
+    name = Column(String(64), primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
+class QuizReportJob(Base):
+    """
+    퀴즈/리포트 생성 작업. 백그라운드 워커가 처리하고 결과를 저장합니다.
+    """
+    __tablename__ = "quiz_report_jobs"
+    __table_args__ = (
+        # 대기 작업 조회 (status = 'pending' AND run_after <= now ORDER BY id)
+        Index("ix_quiz_report_jobs_status_run_after", "status", "run_after"),
+        Index("ix_quiz_report_jobs_user_id_id", "user_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    room_id = Column(Integer, ForeignKey("rooms.id"))
+    # 사용자별 기간(QUIZ_REPORT_DEDUPE_SECONDS)마다 작업은 하나만 만들어집니다.
+    dedupe_key = Column(String(64), unique=True, nullable=False)
+    original_text = Column(String(255))
+    processed_text = Column(String(255))
+    status = Column(String(16), default="pending", nullable=False)  # pending | running | done | failed
+    attempts = Column(Integer, default=0, nullable=False)
+    result = Column(Text)  # ProcessChatDataResponse JSON
+    error = Column(Text)
+    run_after = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class MessageRollup(Base):
+    """
+    사용자/방별 시간·일 단위 메시지 집계. 메시지 저장과 같은 트랜잭션에서 증가합니다.
+    """
+    __tablename__ = "message_rollups"
+    __table_args__ = (
+        # 집계 조회 (scope = ? AND subject_id = ? AND period = ? AND bucket_start BETWEEN ? AND ?)
+        UniqueConstraint("scope", "subject_id", "period", "bucket_start", name="uq_message_rollups_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    scope = Column(String(8), nullable=False)  # user | room
+    subject_id = Column(Integer, nullable=False)
+    period = Column(String(8), nullable=False)  # hour | day
+    bucket_start = Column(DateTime, nullable=False)  # UTC
+    total = Column(Integer, default=0, nullable=False)
+    harmful = Column(Integer, default=0, nullable=False)
+    xp_delta = Column(Integer, default=0, nullable=False)
+
+class ArchiveSegment(Base):
+    """
+    보관된 메시지 세그먼트 파일(방/월별 gzip JSONL)의 색인. 메시지 id 구간으로 페이지를 찾습니다.
+    """
+    __tablename__ = "archive_segments"
+    __table_args__ = (
+        # 같은 메시지 묶음을 두 워커가 동시에 보관해도 색인은 한 번만 들어갑니다.
+        UniqueConstraint("room_id", "first_id", name="uq_archive_segments_room_id_first_id"),
+        # 이전 페이지 (room_id = ? AND first_id < ? ORDER BY last_id DESC)
+        Index("ix_archive_segments_room_id_last_id", "room_id", "last_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    room_id = Column(Integer, nullable=False)
+    month = Column(String(7), nullable=False)  # YYYY-MM
+    path = Column(String(512), nullable=False)  # ARCHIVE_DIR 기준 상대 경로
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    # 세그먼트에서 가장 늦게 만들어진 메시지 시각. 이 시각까지의 날짜는 messages만으로 다시 집계할 수 없습니다.
+    last_created_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -0,0 +1,131 @@
+import asyncio
+import os
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MODERATION_BATCH_ENABLED = os.getenv("MODERATION_BATCH_ENABLED", "0") == "1"
+MODERATION_BATCH_MAX_SIZE = int(os.getenv("MODERATION_BATCH_MAX_SIZE", "32"))
+MODERATION_BATCH_MAX_WAIT_MS = float(os.getenv("MODERATION_BATCH_MAX_WAIT_MS", "5"))
+
+# 업스트림에 배치 엔드포인트가 없다고 판단하는 상태 코드
+_NO_BATCH_STATUS = {404, 405, 501}
+
+
+class ModerationBatcher:
+    """
+    짧은 시간 안에 들어온 유해성 판단 요청을 모아 /process_text_batch 한 번으로 보냅니다.
+    업스트림이 배치를 지원하지 않으면 메시지별 /process_text 호출로 되돌아갑니다.
+    """
+
+    def __init__(self, post_json, base_url: str, max_batch_size: int = MODERATION_BATCH_MAX_SIZE,
+                 max_wait_ms: float = MODERATION_BATCH_MAX_WAIT_MS):
+        self._post_json = post_json
+        self.base_url = base_url
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batch_supported = True
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        self._in_flight: set[asyncio.Task] = set()
+        self.batches_sent = 0
+        self.messages_sent = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, text: str) -> dict:
+        """
+        text에 대한 AI 서버의 원본 응답(dict)을 돌려줍니다. 실패 시 예외를 그대로 던집니다.
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _collect(self) -> list[tuple[str, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # 전송은 별도 태스크로 돌려 다음 배치 수집을 막지 않습니다.
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: list[tuple[str, asyncio.Future]]):
+        # 같은 배치 안의 동일한 문장은 한 번만 보냅니다.
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            results = await self._send(texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future in batch:
+            if future.done():
+                continue
+            result = results[text]
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _send(self, texts: list[str]) -> dict[str, dict | Exception]:
+        self.batches_sent += 1
+        self.messages_sent += len(texts)
+        if self.batch_supported and len(texts) > 1:
+            try:
+                response = await self._post_json(f"{self.base_url}/process_text_batch", {"texts": texts})
+                results = response["results"]
+                if len(results) != len(texts):
+                    raise ValueError(f"batch response has {len(results)} results for {len(texts)} texts")
+                return dict(zip(texts, results))
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in _NO_BATCH_STATUS:
+                    raise
+                print("AI server has no batch endpoint, falling back to per-message calls")
+                self.batch_supported = False
+
+        responses = await asyncio.gather(
+            *(self._post_json(f"{self.base_url}/process_text", {"text": text}) for text in texts),
+            return_exceptions=True,
+        )
+        return dict(zip(texts, responses))
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        self._worker = None
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": MODERATION_BATCH_ENABLED,
+            "batch_supported": self.batch_supported,
+            "batches_sent": self.batches_sent,
+            "messages_sent": self.messages_sent,
+            "avg_batch_size": self.messages_sent / self.batches_sent if self.batches_sent else 0.0,
+        }
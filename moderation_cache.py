@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MODERATION_CACHE_SIZE = int(os.getenv("MODERATION_CACHE_SIZE", "10000"))
+MODERATION_CACHE_TTL = float(os.getenv("MODERATION_CACHE_TTL", "3600"))
+# 설정하면 워커 재시작에도 유지되는 SQLite 공유 캐시를 사용합니다.
+MODERATION_CACHE_DB = os.getenv("MODERATION_CACHE_DB")
+# 공유 캐시에 이만큼 쓸 때마다 만료된 항목을 지웁니다.
+MODERATION_CACHE_PURGE_EVERY = int(os.getenv("MODERATION_CACHE_PURGE_EVERY", "1000"))
+
+
+def normalize_text(text: str) -> str:
+    """
+    캐시 키 계산용 정규화: NFC, 소문자화, 공백 압축.
+    """
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.lower().split())
+
+
+def cache_key(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class _SharedTier:
+    """
+    여러 워커가 함께 쓰는 SQLite 기반 캐시 계층.
+    """
+
+    def __init__(self, path: str, purge_every: int = MODERATION_CACHE_PURGE_EVERY):
+        self._lock = threading.Lock()
+        self.purge_every = purge_every
+        self._writes = 0
+        self.purged = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS moderation_cache ("
+            "key TEXT PRIMARY KEY, result TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_moderation_cache_expires_at ON moderation_cache (expires_at)"
+        )
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, expires_at FROM moderation_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, result: dict, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO moderation_cache (key, result, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(result, ensure_ascii=False), expires_at),
+            )
+            self._writes += 1
+            if self.purge_every and self._writes % self.purge_every == 0:
+                self._purge_expired()
+
+    def _purge_expired(self):
+        self.purged += self._conn.execute(
+            "DELETE FROM moderation_cache WHERE expires_at < ?", (time.time(),)
+        ).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ModerationCache:
+    """
+    정규화된 메시지 텍스트를 키로 하는 유해성 판단 결과 캐시.
+    프로세스 내 LRU(TTL 포함) + 선택적 SQLite 공유 계층으로 구성됩니다.
+    """
+
+    def __init__(self, max_entries: int = MODERATION_CACHE_SIZE, ttl: float = MODERATION_CACHE_TTL,
+                 db_path: str | None = MODERATION_CACHE_DB):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._shared = _SharedTier(db_path) if db_path else None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _get_local(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _set_local(self, key: str, result: dict):
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, text: str) -> dict | None:
+        """
+        캐시된 판단 결과를 반환합니다. 없으면 None.
+        """
+        key = cache_key(text)
+        result = self._get_local(key)
+        if result is None and self._shared is not None:
+            result = await asyncio.to_thread(self._shared.get, key)
+            if result is not None:
+                self.shared_hits += 1
+                self._set_local(key, result)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        result = dict(result)
+        if not result.get("is_harmful"):
+            # 정규화로 묶인 다른 표기일 수 있으므로 원문을 그대로 돌려줍니다.
+            result["purified_text"] = text
+        return result
+
+    async def set(self, text: str, result: dict):
+        key = cache_key(text)
+        self._set_local(key, result)
+        if self._shared is not None:
+            await asyncio.to_thread(self._shared.set, key, result, time.time() + self.ttl)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "shared_tier": self._shared is not None,
+            "shared_purged": self._shared.purged if self._shared is not None else 0,
+        }
+
+    def close(self):
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
+
+moderation_cache = ModerationCache()
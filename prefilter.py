@@ -0,0 +1,202 @@
+import json
+import os
+import re
+import unicodedata
+from collections import deque
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 한 줄에 한 단어/문장씩 적힌 UTF-8 텍스트 파일 경로
+PREFILTER_BLOCKLIST_PATH = os.getenv("PREFILTER_BLOCKLIST_PATH")
+PREFILTER_ALLOWLIST_PATH = os.getenv("PREFILTER_ALLOWLIST_PATH")
+PREFILTER_ENABLED = os.getenv("PREFILTER_ENABLED", "1") == "1"
+# AI 서버가 돌려준 harmful_words를 차단 사전에 추가할지 여부
+PREFILTER_LEARN_FROM_AI = os.getenv("PREFILTER_LEARN_FROM_AI", "0") == "1"
+PREFILTER_MIN_WORD_LENGTH = int(os.getenv("PREFILTER_MIN_WORD_LENGTH", "2"))
+
+DEFAULT_ALLOWLIST = [
+    "hi", "hello", "bye", "ok", "thanks", "thank you", "good morning", "good night",
+    "안녕", "안녕하세요", "안녕~", "반가워", "고마워", "고맙습니다", "감사합니다",
+    "잘자", "잘 자", "좋아", "응", "네", "ㅇㅇ", "ㅇㅋ", "오케이", "미안해", "사랑해",
+]
+
+# ㅋㅋㅋ, ㅎㅎ, ㅠㅠ 같은 웃음/감정 표현이나 문장부호로만 된 메시지
+_TRIVIAL_PATTERN = re.compile(r"^[\sㅋㅎㅠㅜㄷㄱ.,!?~^;:()\-]+$")
+
+
+def _normalize(text: str) -> str:
+    # 매칭 위치를 원문에 그대로 대응시키기 위해 글자 수가 바뀌지 않는 소문자화만 합니다.
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in unicodedata.normalize("NFC", text))
+
+
+def _is_ascii_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+def _on_word_boundary(text: str, start: int, end: int, pattern: str) -> bool:
+    """
+    영문/숫자로 시작하거나 끝나는 패턴은 단어 경계에서만 인정합니다. ("hell"이 "hello"에 걸리지 않도록)
+    한글은 조사가 붙어 쓰이므로 부분 문자열로 찾습니다.
+    """
+    if _is_ascii_word_char(pattern[0]) and start > 0 and _is_ascii_word_char(text[start - 1]):
+        return False
+    if _is_ascii_word_char(pattern[-1]) and end < len(text) and _is_ascii_word_char(text[end]):
+        return False
+    return True
+
+
+def _load_words(path: str | None) -> list[str]:
+    if not path:
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class AhoCorasick:
+    """
+    여러 패턴을 한 번의 순회로 찾는 Aho–Corasick 오토마톤.
+    """
+
+    def __init__(self, patterns: list[str]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[int]] = [[]]
+        self.patterns: list[str] = []
+        for pattern in patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = nxt
+        self._output[state].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def finditer(self, text: str):
+        """
+        (시작 위치, 끝 위치, 패턴) 튜플을 차례로 돌려줍니다.
+        """
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for idx in self._output[state]:
+                pattern = self.patterns[idx]
+                yield i - len(pattern) + 1, i + 1, pattern
+
+
+class PreFilter:
+    """
+    원격 AI 호출 전에 확실히 깨끗하거나 확실히 유해한 메시지를 로컬에서 판정합니다.
+    애매한 메시지는 None을 돌려 AI 서버로 넘깁니다.
+    """
+
+    def __init__(self, blocklist: list[str], allowlist: list[str]):
+        self._blocked = {_normalize(w) for w in blocklist if w.strip()}
+        self._allowed = {" ".join(_normalize(p).split()) for p in allowlist if p.strip()}
+        self._matcher: AhoCorasick | None = None
+        self.local_clean = 0
+        self.local_harmful = 0
+        self.escalated = 0
+
+    def _get_matcher(self) -> AhoCorasick:
+        if self._matcher is None:
+            self._matcher = AhoCorasick(sorted(self._blocked))
+        return self._matcher
+
+    def learn(self, words: list[str]):
+        """
+        AI 서버가 판정한 유해 단어를 차단 사전에 추가합니다.
+        """
+        new_words = {
+            _normalize(w).strip() for w in words
+            if isinstance(w, str) and len(w.strip()) >= PREFILTER_MIN_WORD_LENGTH
+        }
+        new_words -= self._blocked
+        if new_words:
+            self._blocked |= new_words
+            self._matcher = None
+
+    def classify(self, text: str) -> dict | None:
+        normalized = _normalize(text)
+        phrase = " ".join(normalized.split())
+        if not phrase or phrase in self._allowed or _TRIVIAL_PATTERN.match(phrase):
+            self.local_clean += 1
+            return {
+                "is_harmful": False,
+                "purified_text": text,
+                "harmful_words": [],
+                "quiz_results": [],
+                "report_results": {}
+            }
+
+        matches = [
+            (start, end, pattern)
+            for start, end, pattern in (self._get_matcher().finditer(normalized) if self._blocked else ())
+            if _on_word_boundary(normalized, start, end, pattern)
+        ]
+        if not matches:
+            # 단어 안에만 걸린 경우("class"의 "ass")도 로컬에서 유해로 정하지 않고 AI 서버에 맡깁니다.
+            self.escalated += 1
+            return None
+
+        self.local_harmful += 1
+        chars = list(unicodedata.normalize("NFC", text))
+        harmful_words = []
+        for start, end, pattern in matches:
+            chars[start:end] = "*" * (end - start)
+            if pattern not in harmful_words:
+                harmful_words.append(pattern)
+        purified_text = "".join(chars)
+        return {
+            "is_harmful": True,
+            "purified_text": purified_text,
+            "harmful_words": harmful_words,
+            # Quiz/Report 서버에는 AI 서버와 같은 형태로 전달합니다.
+            "raw_processed_text_from_ai_server": json.dumps(
+                {"대체 문장": purified_text, "문장중 유해한 단어들": harmful_words}, ensure_ascii=False
+            ),
+            "quiz_results": [],
+            "report_results": {}
+        }
+
+    def stats(self) -> dict:
+        return {
+            "enabled": PREFILTER_ENABLED,
+            "blocklist_size": len(self._blocked),
+            "allowlist_size": len(self._allowed),
+            "local_clean": self.local_clean,
+            "local_harmful": self.local_harmful,
+            "escalated": self.escalated,
+        }
+
+
+prefilter = PreFilter(
+    blocklist=_load_words(PREFILTER_BLOCKLIST_PATH),
+    allowlist=DEFAULT_ALLOWLIST + _load_words(PREFILTER_ALLOWLIST_PATH),
+)
@@ -0,0 +1,208 @@
+"""
+토큰 버킷 기반 입장 제어(admission control).
+
+WebSocket 메시지는 보낸 사람 / 방 / 전체 버킷을 모두 통과해야 유해성 판단과 저장으로 넘어갑니다.
+잠깐만 기다리면 되는 경우(RATE_LIMIT_MAX_DELAY 이하)는 늦춰서 받고, 그보다 오래 걸리면 거절합니다.
+/token, /users/ 는 클라이언트 IP별 버킷으로, /token은 사용자 이름별 버킷으로도 제한합니다.
+IP 한도는 학교처럼 한 NAT 뒤에서 반 전체가 동시에 로그인하는 경우를 막지 않을 만큼 넉넉하게 두고,
+비밀번호 대입은 사용자 이름별 한도가 막습니다.
+버킷은 프로세스(워커)별이므로 워커가 N개면 전체 한도는 N배가 됩니다.
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+
+# 초당 메시지 수와 한 번에 몰아 보낼 수 있는 양(burst). rate가 0이면 그 단위는 제한하지 않습니다.
+WS_USER_RATE = float(os.getenv("WS_USER_RATE", "5"))
+WS_USER_BURST = float(os.getenv("WS_USER_BURST", "10"))
+WS_ROOM_RATE = float(os.getenv("WS_ROOM_RATE", "50"))
+WS_ROOM_BURST = float(os.getenv("WS_ROOM_BURST", "100"))
+WS_GLOBAL_RATE = float(os.getenv("WS_GLOBAL_RATE", "0"))
+WS_GLOBAL_BURST = float(os.getenv("WS_GLOBAL_BURST", "500"))
+# 이 시간(초) 안에 토큰이 생기면 거절하지 않고 기다렸다가 받습니다.
+RATE_LIMIT_MAX_DELAY = float(os.getenv("RATE_LIMIT_MAX_DELAY", "0.5"))
+# /token, /users/ 의 IP별 분당 요청 수
+AUTH_RATE_LIMIT_PER_MINUTE = float(os.getenv("AUTH_RATE_LIMIT_PER_MINUTE", "600"))
+AUTH_RATE_LIMIT_BURST = float(os.getenv("AUTH_RATE_LIMIT_BURST", "200"))
+# /token 의 사용자 이름별 분당 요청 수
+LOGIN_RATE_LIMIT_PER_USERNAME_PER_MINUTE = float(os.getenv("LOGIN_RATE_LIMIT_PER_USERNAME_PER_MINUTE", "10"))
+LOGIN_RATE_LIMIT_USERNAME_BURST = float(os.getenv("LOGIN_RATE_LIMIT_USERNAME_BURST", "5"))
+# 이 주소(쉼표 구분)에서 온 요청은 리버스 프록시를 거친 것으로 보고 X-Forwarded-For에서 클라이언트 IP를 찾습니다.
+AUTH_TRUSTED_PROXIES = {address.strip() for address in os.getenv("AUTH_TRUSTED_PROXIES", "").split(",") if address.strip()}
+# 기억할 최대 버킷 수(단위별). 오래 안 쓴 버킷부터 버리며, 버린 버킷은 가득 찬 상태로 다시 시작합니다.
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+class RateLimited(Exception):
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded ({scope})")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def wait_time(self, now: float, cost: float = 1) -> float:
+        """
+        cost만큼 쓸 수 있을 때까지 기다려야 하는 시간(초).
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost: float = 1):
+        # 기다리기로 한 요청은 미리 토큰을 가져가므로 음수가 될 수 있습니다. 뒤에 온 요청은 그만큼 더 기다립니다.
+        self.tokens -= cost
+
+
+class KeyedBuckets:
+    """
+    키(사용자, 방, IP 등)별 토큰 버킷. rate가 0이면 항상 통과합니다.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[object, TokenBucket] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def bucket(self, key, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, now)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class ChatAdmission:
+    """
+    WebSocket 채팅 메시지 입장 제어. admit()이 돌려준 시간만큼 기다린 뒤 처리하거나, RateLimited로 거절합니다.
+    """
+
+    def __init__(self, max_delay: float = RATE_LIMIT_MAX_DELAY):
+        self.max_delay = max_delay
+        self.scopes = {
+            "user": KeyedBuckets(WS_USER_RATE, WS_USER_BURST),
+            "room": KeyedBuckets(WS_ROOM_RATE, WS_ROOM_BURST),
+            "global": KeyedBuckets(WS_GLOBAL_RATE, WS_GLOBAL_BURST),
+        }
+        self.admitted = 0
+        self.delayed = 0
+        self.rejected = {scope: 0 for scope in self.scopes}
+
+    def admit(self, sender_id: int, room_id: int) -> tuple[float, str | None]:
+        """
+        받아도 되면 (기다릴 시간(초, 대부분 0), 늦춘 단위)를 돌려줍니다. 너무 오래 기다려야 하면 RateLimited.
+        """
+        now = time.monotonic()
+        keys = {"user": sender_id, "room": room_id, "global": None}
+        buckets = []
+        wait, limiting_scope = 0.0, None
+        for scope, keyed in self.scopes.items():
+            if not keyed.enabled:
+                continue
+            bucket = keyed.bucket(keys[scope], now)
+            buckets.append(bucket)
+            scope_wait = bucket.wait_time(now)
+            if scope_wait > wait:
+                wait, limiting_scope = scope_wait, scope
+        if wait > self.max_delay:
+            # 거절한 메시지는 어느 버킷의 토큰도 쓰지 않습니다.
+            self.rejected[limiting_scope] += 1
+            raise RateLimited(limiting_scope, wait)
+        for bucket in buckets:
+            bucket.consume()
+        self.admitted += 1
+        if wait > 0:
+            self.delayed += 1
+        return wait, limiting_scope
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "delayed": self.delayed,
+            "rejected_user": self.rejected["user"],
+            "rejected_room": self.rejected["room"],
+            "rejected_global": self.rejected["global"],
+            "tracked_users": len(self.scopes["user"]),
+            "tracked_rooms": len(self.scopes["room"]),
+        }
+
+
+class RequestRateLimiter:
+    """
+    HTTP 엔드포인트용 키별 제한. 초과하면 바로 RateLimited(429)로 거절합니다.
+    """
+
+    def __init__(self, scope: str, per_minute: float = AUTH_RATE_LIMIT_PER_MINUTE, burst: float = AUTH_RATE_LIMIT_BURST):
+        self.scope = scope
+        self._buckets = KeyedBuckets(per_minute / 60, burst)
+        self.allowed = 0
+        self.rejected = 0
+
+    def check(self, key):
+        if not self._buckets.enabled:
+            return
+        now = time.monotonic()
+        bucket = self._buckets.bucket(key, now)
+        wait = bucket.wait_time(now)
+        if wait > 0:
+            self.rejected += 1
+            raise RateLimited(self.scope, wait)
+        bucket.consume()
+        self.allowed += 1
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "tracked_clients": len(self._buckets),
+        }
+
+
+def client_ip(peer: str, forwarded_for: str | None, trusted_proxies: set[str] = AUTH_TRUSTED_PROXIES) -> str:
+    """
+    요청의 클라이언트 IP. 직접 연결한 쪽(peer)이 신뢰하는 프록시일 때만 X-Forwarded-For를 보며,
+    오른쪽부터 신뢰하는 프록시를 건너뛴 첫 주소를 씁니다. (왼쪽 값은 클라이언트가 꾸밀 수 있습니다)
+    """
+    if peer not in trusted_proxies or not forwarded_for:
+        return peer
+    addresses = [address.strip() for address in forwarded_for.split(",") if address.strip()]
+    for address in reversed(addresses):
+        if address not in trusted_proxies:
+            return address
+    return addresses[0] if addresses else peer
+
+
+def retry_after_header(retry_after: float) -> str:
+    # Retry-After는 정수 초만 허용됩니다.
+    return str(max(1, math.ceil(retry_after)))
+
+
+chat_admission = ChatAdmission()
+login_limiter = RequestRateLimiter("login")
+login_username_limiter = RequestRateLimiter(
+    "login_username", per_minute=LOGIN_RATE_LIMIT_PER_USERNAME_PER_MINUTE, burst=LOGIN_RATE_LIMIT_USERNAME_BURST
+)
+signup_limiter = RequestRateLimiter("signup")
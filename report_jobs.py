@@ -0,0 +1,183 @@
+import asyncio
+import datetime
+import os
+import time
+
+import crud
+import schemas
+from database import AsyncSessionLocal
+
+QUIZ_REPORT_WORKERS = int(os.getenv("QUIZ_REPORT_WORKERS", "2"))
+QUIZ_REPORT_MAX_ATTEMPTS = int(os.getenv("QUIZ_REPORT_MAX_ATTEMPTS", "5"))
+# n번째 실패 후 QUIZ_REPORT_RETRY_BASE_SECONDS * 2^(n-1)초 뒤에 다시 시도합니다.
+QUIZ_REPORT_RETRY_BASE_SECONDS = float(os.getenv("QUIZ_REPORT_RETRY_BASE_SECONDS", "5"))
+QUIZ_REPORT_RETRY_MAX_SECONDS = float(os.getenv("QUIZ_REPORT_RETRY_MAX_SECONDS", "300"))
+# 사용자마다 이 기간에 작업을 하나만 만듭니다.
+QUIZ_REPORT_DEDUPE_SECONDS = int(os.getenv("QUIZ_REPORT_DEDUPE_SECONDS", "3600"))
+# 새 작업 알림이 없어도 이 주기로 대기 작업(다른 워커가 만든 것, 재시도 예정인 것)을 확인합니다.
+QUIZ_REPORT_POLL_SECONDS = float(os.getenv("QUIZ_REPORT_POLL_SECONDS", "5"))
+# running 상태로 이 시간 넘게 남은 작업은 워커가 죽은 것으로 보고 다시 대기시킵니다.
+QUIZ_REPORT_STALE_SECONDS = float(os.getenv("QUIZ_REPORT_STALE_SECONDS", "600"))
+
+
+def dedupe_key(user_id: int, now: datetime.datetime) -> str:
+    window = int(now.timestamp()) // QUIZ_REPORT_DEDUPE_SECONDS
+    return f"{user_id}:{window}"
+
+
+def job_to_schema(job) -> schemas.QuizReportJob:
+    result = schemas.ProcessChatDataResponse.model_validate_json(job.result) if job.result else None
+    return schemas.QuizReportJob(
+        id=job.id,
+        user_id=job.user_id,
+        room_id=job.room_id,
+        status=job.status,
+        attempts=job.attempts,
+        quiz_results=result.quiz_results if result else [],
+        report_results=result.report_results if result else None,
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+    )
+
+
+class QuizReportQueue:
+    """
+    퀴즈/리포트 생성을 채팅 경로 밖에서 처리하는 작업 큐.
+
+    작업은 quiz_report_jobs 테이블에 저장되므로 재시작해도 사라지지 않고, 여러 워커 프로세스가
+    같은 테이블을 나눠 처리할 수 있습니다. 완료된 결과는 deliver로 전달됩니다(quiz_report 이벤트).
+    """
+
+    def __init__(self, generate, deliver, workers: int = QUIZ_REPORT_WORKERS,
+                 max_attempts: int = QUIZ_REPORT_MAX_ATTEMPTS, poll_seconds: float = QUIZ_REPORT_POLL_SECONDS):
+        self._generate = generate
+        self._deliver = deliver
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self._wakeup: asyncio.Event | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._last_requeue = 0.0
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.requeued = 0
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        await self._requeue_stale()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def enqueue(self, user_id: int, room_id: int | None, original_text: str, processed_text: str) -> int | None:
+        """
+        작업을 저장하고 워커를 깨웁니다. 같은 기간에 이미 작업이 있으면 None.
+        """
+        async with AsyncSessionLocal() as db:
+            job = await db.run_sync(
+                crud.create_quiz_report_job,
+                user_id=user_id,
+                room_id=room_id,
+                original_text=original_text,
+                processed_text=processed_text,
+                dedupe_key=dedupe_key(user_id, datetime.datetime.utcnow()),
+            )
+        if job is None:
+            self.deduplicated += 1
+            return None
+        self.enqueued += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job.id
+
+    async def _requeue_stale(self):
+        """
+        running으로 QUIZ_REPORT_STALE_SECONDS 넘게 남은 작업을 다시 대기시킵니다.
+        """
+        # 워커들이 함께 쓰므로 기다리기 전에 시각을 먼저 적어 중복 실행을 막습니다.
+        self._last_requeue = time.monotonic()
+        older_than = datetime.datetime.utcnow() - datetime.timedelta(seconds=QUIZ_REPORT_STALE_SECONDS)
+        async with AsyncSessionLocal() as db:
+            requeued = await db.run_sync(crud.requeue_stale_quiz_report_jobs, older_than=older_than)
+        if requeued:
+            self.requeued += requeued
+            print(f"Requeued {requeued} stale quiz/report jobs")
+
+    async def _run(self):
+        while True:
+            # 죽은 워커나 실패한 처리로 running에 남은 작업을 재시작을 기다리지 않고 폴링 주기마다 되살립니다.
+            if time.monotonic() - self._last_requeue >= self.poll_seconds:
+                try:
+                    await self._requeue_stale()
+                except Exception as e:
+                    print("Quiz/report stale job requeue error:", e)
+            try:
+                async with AsyncSessionLocal() as db:
+                    job = await db.run_sync(crud.claim_quiz_report_job, now=datetime.datetime.utcnow())
+            except Exception as e:
+                print("Quiz/report job claim error:", e)
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(job)
+            except Exception as e:
+                # 워커는 계속 돕니다. 작업은 running으로 남았다가 QUIZ_REPORT_STALE_SECONDS 뒤 폴링에서 다시 대기열로 돌아갑니다.
+                print(f"Quiz/report job {job.id} error:", e)
+
+    async def _process(self, job):
+        try:
+            response = await self._generate(
+                user_id=job.user_id, original_text=job.original_text, processed_text=job.processed_text
+            )
+        except Exception as e:
+            error = str(getattr(e, "detail", e))
+            if job.attempts >= self.max_attempts:
+                self.failed += 1
+                status, run_after = "failed", None
+            else:
+                self.retried += 1
+                delay = min(QUIZ_REPORT_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1), QUIZ_REPORT_RETRY_MAX_SECONDS)
+                status, run_after = "pending", datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+            print(f"Quiz/report job {job.id} attempt {job.attempts} failed: {error}")
+            async with AsyncSessionLocal() as db:
+                await db.run_sync(
+                    crud.finish_quiz_report_job, job_id=job.id, status=status, error=error, run_after=run_after
+                )
+            return
+
+        async with AsyncSessionLocal() as db:
+            await db.run_sync(
+                crud.finish_quiz_report_job, job_id=job.id, status="done", result=response.model_dump_json()
+            )
+            job = await db.run_sync(crud.get_quiz_report_job, job_id=job.id)
+        self.completed += 1
+        try:
+            await self._deliver(job_to_schema(job))
+        except Exception as e:
+            # 결과는 저장돼 있으므로 폴링으로 받을 수 있습니다.
+            print(f"Quiz/report job {job.id} delivery error: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "enqueued": self.enqueued,
+            "deduplicated": self.deduplicated,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "requeued": self.requeued,
+        }
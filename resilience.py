@@ -0,0 +1,244 @@
+"""
+AI 업스트림 호출 공통 보호 장치: 서킷 브레이커, 지연 백분위 기반 적응형 타임아웃, 헤지 요청.
+
+업스트림(moderation / story / quiz_report)마다 Upstream 하나를 두고 ai_request.post_json이 거쳐 갑니다.
+서킷이 열려 있으면 CircuitOpenError(httpx.HTTPError)로 즉시 실패하므로,
+호출부의 기존 httpx.HTTPError 처리(깨끗한 문장으로 간주, 500 응답, 작업 재시도)가 그대로 폴백이 됩니다.
+"""
+import asyncio
+import functools
+import os
+import time
+from collections import deque
+
+import httpx
+
+from metrics import upstream_errors_total, upstream_request_seconds
+
+# 연속으로 이만큼 실패하면 서킷을 엽니다.
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+# 서킷을 연 뒤 이 시간(초)이 지나면 요청 하나로 회복 여부를 확인합니다. (half-open)
+AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", "10"))
+# 기본은 끔. 켜면 타임아웃 = 최근 지연의 AI_TIMEOUT_PERCENTILE 백분위 * AI_TIMEOUT_MULTIPLIER (AI_TIMEOUT_MIN ~ 호출부 타임아웃)
+AI_ADAPTIVE_TIMEOUT = os.getenv("AI_ADAPTIVE_TIMEOUT", "0") == "1"
+AI_TIMEOUT_PERCENTILE = float(os.getenv("AI_TIMEOUT_PERCENTILE", "99"))
+AI_TIMEOUT_MULTIPLIER = float(os.getenv("AI_TIMEOUT_MULTIPLIER", "2"))
+AI_TIMEOUT_MIN = float(os.getenv("AI_TIMEOUT_MIN", "0.5"))
+AI_LATENCY_WINDOW = int(os.getenv("AI_LATENCY_WINDOW", "200"))
+# 적응형 타임아웃/헤지를 쓰기 전에 필요한 최소 표본 수
+AI_LATENCY_MIN_SAMPLES = int(os.getenv("AI_LATENCY_MIN_SAMPLES", "20"))
+# 헤지 요청을 보낼 업스트림 (쉼표 구분). 응답이 AI_HEDGE_PERCENTILE 백분위보다 늦으면 같은 요청을 하나 더 보냅니다.
+AI_HEDGE_UPSTREAMS = {name for name in os.getenv("AI_HEDGE_UPSTREAMS", "").split(",") if name}
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", "95"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(httpx.HTTPError):
+    """
+    서킷이 열려 있어 업스트림을 호출하지 않았습니다.
+    """
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    업스트림 장애로 볼 실패인지. 4xx(잘못된 요청, 배치 엔드포인트 없음 등)는 제외합니다.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class LatencyTracker:
+    """
+    최근 응답 지연(초)의 이동 창. 시간 초과된 호출은 그때의 타임아웃 값으로 들어갑니다.
+    """
+
+    def __init__(self, window: int = AI_LATENCY_WINDOW):
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(int(len(ordered) * p / 100), len(ordered) - 1)
+        return ordered[index]
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = AI_BREAKER_FAILURES, reset_seconds: float = AI_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._probing:
+            # half-open에서는 확인용 요청 하나만 보냅니다.
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._probing = False
+        self.state = CLOSED
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """
+        성공/실패를 판단할 수 없이 끝난 호출(취소, 4xx 등)의 확인 슬롯을 돌려줍니다.
+        """
+        self._probing = False
+
+
+class Upstream:
+    def __init__(self, name: str, hedge: bool | None = None, adaptive_timeout: bool = AI_ADAPTIVE_TIMEOUT):
+        self.name = name
+        self.hedge = name in AI_HEDGE_UPSTREAMS if hedge is None else hedge
+        self.adaptive_timeout = adaptive_timeout
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def timeout(self, ceiling: float) -> float:
+        """
+        최근 지연에 맞춘 타임아웃. 표본이 모자라면 호출부가 준 값(ceiling)을 그대로 씁니다.
+        """
+        if not self.adaptive_timeout or len(self.latency) < AI_LATENCY_MIN_SAMPLES:
+            return ceiling
+        observed = self.latency.percentile(AI_TIMEOUT_PERCENTILE) * AI_TIMEOUT_MULTIPLIER
+        return min(max(observed, AI_TIMEOUT_MIN), ceiling)
+
+    def _hedge_delay(self) -> float | None:
+        if not self.hedge or len(self.latency) < AI_LATENCY_MIN_SAMPLES:
+            return None
+        return self.latency.percentile(AI_HEDGE_PERCENTILE)
+
+    async def call(self, send, ceiling: float):
+        """
+        send(timeout, on_acquired)로 요청을 보냅니다. 서킷이 열려 있으면 CircuitOpenError.
+        send는 동시 요청 슬롯을 얻은 순간 on_acquired()를 부르고, 지연은 그때부터 잽니다.
+        """
+        if not self.breaker.allow():
+            self.rejected += 1
+            upstream_errors_total.inc(upstream=self.name, error="CircuitOpen")
+            raise CircuitOpenError(f"Circuit for {self.name} upstream is open")
+        self.calls += 1
+        # half-open 확인 요청은 느려진 업스트림도 회복으로 볼 수 있게 호출부 타임아웃을 그대로 씁니다.
+        timeout = ceiling if self.breaker.state == HALF_OPEN else self.timeout(ceiling)
+        started = time.perf_counter()
+        acquired_at = None
+
+        def on_acquired():
+            nonlocal acquired_at
+            if acquired_at is None:
+                acquired_at = time.perf_counter()
+
+        try:
+            result = await self._send(functools.partial(send, on_acquired=on_acquired), timeout)
+        except BaseException as e:
+            elapsed = time.perf_counter() - (acquired_at or started)
+            # 슬롯을 기다리다 끝난 호출은 업스트림까지 가지 않았으므로 장애로 세지 않습니다.
+            if acquired_at is not None and isinstance(e, Exception) and is_upstream_failure(e):
+                self.failures += 1
+                if isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)):
+                    # 업스트림이 느려지면 시간 초과만 나서 성공 표본이 안 생깁니다.
+                    # 타임아웃 값을 표본으로 넣어 다음 타임아웃이 늘어나게 합니다.
+                    self.latency.record(timeout)
+                self.breaker.record_failure()
+                upstream_request_seconds.observe(elapsed, upstream=self.name, outcome="failure")
+            else:
+                self.breaker.release()
+                upstream_request_seconds.observe(elapsed, upstream=self.name, outcome="other")
+            if isinstance(e, Exception):
+                upstream_errors_total.inc(upstream=self.name, error=type(e).__name__)
+            raise
+        elapsed = time.perf_counter() - (acquired_at or started)
+        self.latency.record(elapsed)
+        self.breaker.record_success()
+        upstream_request_seconds.observe(elapsed, upstream=self.name, outcome="success")
+        return result
+
+    async def _send(self, send, timeout: float):
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None or hedge_delay >= timeout:
+            return await send(timeout)
+
+        primary = asyncio.create_task(send(timeout))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            # 첫 요청이 평소보다 늦으면 같은 요청을 하나 더 보내 먼저 온 응답을 씁니다.
+            self.hedged += 1
+            backup = asyncio.create_task(send(max(timeout - hedge_delay, AI_TIMEOUT_MIN)))
+            pending = {primary, backup}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        p50 = self.latency.percentile(50)
+        p99 = self.latency.percentile(99)
+        # 적응형 타임아웃이 꺼져 있거나 표본이 모자라면 호출부의 ceiling을 그대로 쓰므로 보여줄 값이 없습니다.
+        adaptive = self.adaptive_timeout and len(self.latency) >= AI_LATENCY_MIN_SAMPLES
+        return {
+            "state": self.breaker.state,
+            "circuit_open": self.breaker.state != CLOSED,
+            "times_opened": self.breaker.times_opened,
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+            "timeout_seconds": round(self.timeout(float("inf")), 3) if adaptive else None,
+        }
+
+
+upstreams = {
+    "moderation": Upstream("moderation"),
+    "story": Upstream("story"),
+    "quiz_report": Upstream("quiz_report"),
+}
@@ -11,6 +11,7 @@ class MessageCreate(MessageBase):
     character_state: str
     experience_points: int
     is_harmful: bool
+    created_at: Optional[datetime.datetime] = None
 
 class Message(MessageBase):
     id: int
@@ -32,11 +33,14 @@ class RoomCreate(RoomBase):
 
 class Room(RoomBase):
     id: int
-    messages: list[Message] = []
 
     class Config:
         from_attributes = True
 
+class RoomSummary(Room):
+    message_count: int = 0
+    last_message: Optional[Message] = None
+
 class UserBase(BaseModel):
     username: str
     phone_number: str
@@ -52,7 +56,6 @@ class User(UserBase):
     level: int
     character_state: str
     harmful_chat_count: int
-    messages: list[Message] = []
 
     class Config:
         from_attributes = True
@@ -84,6 +87,39 @@ class ProcessChatDataResponse(BaseModel):
     quiz_results: List[QuizResult] = Field(default_factory=list)
     report_results: Optional[ReportResult] = None
 
+class QuizReportJob(BaseModel):
+    id: int
+    user_id: int
+    room_id: Optional[int] = None
+    status: str
+    attempts: int
+    quiz_results: List[QuizResult] = Field(default_factory=list)
+    report_results: Optional[ReportResult] = None
+    error: Optional[str] = None
+    created_at: datetime.datetime
+    updated_at: Optional[datetime.datetime] = None
+
+class MessageRollup(BaseModel):
+    bucket_start: datetime.datetime
+    total: int
+    harmful: int
+    xp_delta: int
+
+    class Config:
+        from_attributes = True
+
+class MessageRollupSummary(BaseModel):
+    scope: str  # user | room
+    subject_id: int
+    period: str  # hour | day
+    start: datetime.datetime
+    end: datetime.datetime
+    total: int
+    harmful: int
+    xp_delta: int
+    # 메시지가 있었던 버킷만 담깁니다.
+    buckets: List[MessageRollup] = Field(default_factory=list)
+
 # New schemas for /ai-story endpoint
 class DiaryEntryRequest(BaseModel):
     title: str
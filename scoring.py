@@ -0,0 +1,23 @@
+"""
+유해성 판단 결과에 따른 경험치/캐릭터 상태 규칙. 다른 모듈에 의존하지 않아 crud에서도 씁니다.
+"""
+HARMFUL_XP_DELTA = -10
+CLEAN_XP_DELTA = 5
+
+
+def status_delta(is_harmful: bool) -> tuple[int, str, int]:
+    """
+    유해성 판단 결과에 따른 (경험치 증감, 캐릭터 상태, 유해 채팅 수 증감)
+    """
+    if is_harmful:
+        return HARMFUL_XP_DELTA, "crying", 1
+    return CLEAN_XP_DELTA, "smiling", 0
+
+
+def compute_user_status(experience_points: int, harmful_chat_count: int, is_harmful: bool) -> tuple[int, str, int]:
+    """
+    유해성 판단 결과에 따른 (경험치, 캐릭터 상태, 유해 채팅 수)를 계산합니다.
+    """
+    xp_delta, new_state, harmful_delta = status_delta(is_harmful)
+    # 경험치는 0 미만으로 내려가지 않도록 방지
+    return max(experience_points + xp_delta, 0), new_state, harmful_chat_count + harmful_delta
@@ -0,0 +1,80 @@
+import json
+
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic_core import to_json, to_jsonable_python
+
+from metrics import chat_stage_seconds
+
+try:
+    import msgpack
+except ImportError:  # msgpack이 없으면 JSON만 지원합니다.
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+
+def negotiate_format(websocket: WebSocket) -> str:
+    """
+    연결별 전송 포맷을 정합니다. ?format=msgpack 쿼리 또는 msgpack 서브프로토콜을 지원합니다.
+    """
+    if msgpack is None:
+        return JSON
+    if websocket.query_params.get("format") == MSGPACK:
+        return MSGPACK
+    if MSGPACK in websocket.scope.get("subprotocols", []):
+        return MSGPACK
+    return JSON
+
+
+def accept_subprotocol(websocket: WebSocket) -> str | None:
+    if msgpack is not None and MSGPACK in websocket.scope.get("subprotocols", []):
+        return MSGPACK
+    return None
+
+
+class BroadcastPayload:
+    """
+    브로드캐스트 메시지 하나. 포맷별로 최초 한 번만 인코딩하고 모든 수신자가 같은 버퍼를 씁니다.
+    """
+
+    __slots__ = ("payload", "_encoded")
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        self._encoded: dict[str, str | bytes] = {}
+
+    def encode(self, fmt: str) -> str | bytes:
+        encoded = self._encoded.get(fmt)
+        if encoded is None:
+            if fmt == MSGPACK:
+                encoded = msgpack.packb(to_jsonable_python(self.payload))
+            else:
+                # 텍스트 프레임으로 보내야 하므로 문자열로 한 번만 디코딩합니다.
+                encoded = to_json(self.payload).decode("utf-8")
+            self._encoded[fmt] = encoded
+        return encoded
+
+
+async def send_payload(websocket: WebSocket, payload: BroadcastPayload, fmt: str):
+    encoded = payload.encode(fmt)
+    if isinstance(encoded, bytes):
+        await websocket.send_bytes(encoded)
+    else:
+        await websocket.send_text(encoded)
+
+
+async def receive_json(websocket: WebSocket, fmt: str) -> dict:
+    """
+    클라이언트 프레임을 받아 dict로 디코딩합니다. msgpack 연결도 텍스트(JSON) 프레임을 보낼 수 있습니다.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message["code"], message.get("reason"))
+    # 클라이언트를 기다린 시간은 빼고 디코딩만 잽니다.
+    with chat_stage_seconds.time(path="websocket", stage="receive"):
+        if message.get("bytes") is not None:
+            if fmt == MSGPACK:
+                return msgpack.unpackb(message["bytes"])
+            return json.loads(message["bytes"])
+        return json.loads(message["text"])
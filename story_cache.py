@@ -0,0 +1,153 @@
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict
+
+STORY_CACHE_TTL = float(os.getenv("STORY_CACHE_TTL", "600"))
+# risk_score마다 재사용할 서로 다른 이야기 수. 0이면 캐시하지 않고 동시 요청 합치기만 합니다.
+STORY_CACHE_POOL_SIZE = int(os.getenv("STORY_CACHE_POOL_SIZE", "5"))
+# 캐시를 유지할 최대 risk_score 수
+STORY_CACHE_MAX_KEYS = int(os.getenv("STORY_CACHE_MAX_KEYS", "101"))
+# 0보다 크면 아래 risk_score마다 이 수만큼 이야기를 미리 만들어 두고, 요청마다 하나씩 꺼내 줍니다.
+STORY_PREFILL_SIZE = int(os.getenv("STORY_PREFILL_SIZE", "0"))
+# /ai-story의 기분별 risk_score
+STORY_PREFILL_BUCKETS = [int(v) for v in os.getenv("STORY_PREFILL_BUCKETS", "10,50,80,95").split(",") if v]
+STORY_PREFILL_RETRY_SECONDS = float(os.getenv("STORY_PREFILL_RETRY_SECONDS", "5"))
+
+
+class StoryCache:
+    """
+    risk_score별 이야기 생성 결과 캐시.
+
+    같은 risk_score의 동시 요청은 업스트림 호출 하나를 함께 기다리고(single-flight),
+    결과는 risk_score마다 최대 pool_size개까지 TTL 동안 재사용하고, 업스트림이 실패하면 만료된 것이라도 돌려줍니다.
+    prefill_size를 주면 버킷마다 백그라운드에서 이야기를 미리 만들어 두고
+    요청이 오면 하나씩 꺼내 주므로, 업스트림 생성 시간을 기다리지 않습니다.
+    """
+
+    def __init__(self, fetch, ttl: float = STORY_CACHE_TTL, pool_size: int = STORY_CACHE_POOL_SIZE,
+                 max_keys: int = STORY_CACHE_MAX_KEYS, prefill_size: int = STORY_PREFILL_SIZE,
+                 prefill_buckets: list[int] = STORY_PREFILL_BUCKETS):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.pool_size = pool_size
+        self.max_keys = max_keys
+        self.prefill_size = prefill_size
+        self.prefill_buckets = prefill_buckets if prefill_size > 0 else []
+        # risk_score -> [(만료 시각, 이야기)]
+        self._pools: OrderedDict[int, list[tuple[float, object]]] = OrderedDict()
+        self._prefilled: dict[int, list[tuple[float, object]]] = {bucket: [] for bucket in self.prefill_buckets}
+        self._in_flight: dict[int, asyncio.Task] = {}
+        self._refill_signals: dict[int, asyncio.Event] = {}
+        self._refill_tasks: list[asyncio.Task] = []
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.prefill_hits = 0
+        self.stale_served = 0
+
+    async def start(self):
+        for bucket in self.prefill_buckets:
+            self._refill_signals[bucket] = asyncio.Event()
+            self._refill_tasks.append(asyncio.create_task(self._refill(bucket)))
+
+    async def close(self):
+        for task in self._refill_tasks:
+            task.cancel()
+        await asyncio.gather(*self._refill_tasks, return_exceptions=True)
+        self._refill_tasks.clear()
+
+    @staticmethod
+    def _fresh(entries: list[tuple[float, object]]) -> list[tuple[float, object]]:
+        now = time.time()
+        return [entry for entry in entries if entry[0] > now]
+
+    async def get(self, risk_score: int):
+        prefilled = self._prefilled.get(risk_score)
+        if prefilled is not None:
+            prefilled[:] = self._fresh(prefilled)
+            if prefilled:
+                self.prefill_hits += 1
+                self._refill_signals[risk_score].set()
+                return prefilled.pop(0)[1]
+
+        pool = self._pools.get(risk_score)
+        fresh = self._fresh(pool) if pool else []
+        # 풀이 다 차면 재사용하고, 덜 찼으면 새로 만들어 다양성을 채웁니다.
+        if fresh and len(fresh) >= self.pool_size:
+            self.hits += 1
+            self._pools.move_to_end(risk_score)
+            return random.choice(fresh)[1]
+
+        self.misses += 1
+        try:
+            story = await self._single_flight(risk_score)
+        except Exception:
+            if pool:
+                # 업스트림 장애 중에는 만료된 이야기라도 돌려줍니다.
+                self.stale_served += 1
+                return random.choice(pool)[1]
+            raise
+        if self.pool_size > 0:
+            pool = self._pools.setdefault(risk_score, [])
+            pool[:] = self._fresh(pool)
+            if all(entry is not story for _, entry in pool):
+                pool.append((time.time() + self.ttl, story))
+                del pool[:-self.pool_size]
+            self._pools.move_to_end(risk_score)
+            while len(self._pools) > self.max_keys:
+                self._pools.popitem(last=False)
+        return story
+
+    async def _single_flight(self, risk_score: int):
+        task = self._in_flight.get(risk_score)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            # 먼저 온 요청이 취소돼도 함께 기다리는 요청을 위해 호출은 계속됩니다.
+            task = asyncio.create_task(self._fetch(risk_score))
+            self._in_flight[risk_score] = task
+            task.add_done_callback(lambda done: self._finish(risk_score, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, risk_score: int, task: asyncio.Task):
+        self._in_flight.pop(risk_score, None)
+        if not task.cancelled():
+            # 기다리던 요청이 모두 취소됐어도 "never retrieved" 경고가 나지 않도록 표시합니다.
+            task.exception()
+
+    async def _refill(self, bucket: int):
+        signal = self._refill_signals[bucket]
+        prefilled = self._prefilled[bucket]
+        while True:
+            prefilled[:] = self._fresh(prefilled)
+            if len(prefilled) >= self.prefill_size:
+                signal.clear()
+                # 꺼내 가거나 가장 오래된 이야기가 만료될 때 다시 채웁니다.
+                timeout = prefilled[0][0] - time.time() if prefilled else None
+                try:
+                    await asyncio.wait_for(signal.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                story = await self._fetch(bucket)
+            except Exception as e:
+                print(f"Story prefill for risk_score {bucket} failed: {e}")
+                await asyncio.sleep(STORY_PREFILL_RETRY_SECONDS)
+                continue
+            prefilled.append((time.time() + self.ttl, story))
+
+    def stats(self) -> dict:
+        return {
+            "cached_keys": len(self._pools),
+            "cached_stories": sum(len(pool) for pool in self._pools.values()),
+            "prefilled": {bucket: len(stories) for bucket, stories in self._prefilled.items()},
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "prefill_hits": self.prefill_hits,
+            "stale_served": self.stale_served,
+        }
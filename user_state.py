@@ -0,0 +1,182 @@
+import asyncio
+import functools
+import os
+import time
+import weakref
+from collections import OrderedDict
+
+import crud
+import write_behind
+from database import AsyncSessionLocal
+from scoring import compute_user_status, status_delta
+from write_behind import message_writer
+
+# 메모리에 들고 있을 최대 사용자 수. 넘치면 가장 오래 안 쓰인 사용자부터 비웁니다.
+USER_STATE_CACHE_SIZE = int(os.getenv("USER_STATE_CACHE_SIZE", "10000"))
+# 저장이 끝난 항목을 믿는 시간(초). 다른 워커가 같은 사용자를 갱신했을 수 있으므로 지나면 DB에서 다시 읽습니다.
+USER_STATE_CACHE_TTL = float(os.getenv("USER_STATE_CACHE_TTL", "5"))
+
+
+class _UserState:
+    __slots__ = ("status", "dirty", "loaded_at")
+
+    def __init__(self, status: tuple[int, str, int]):
+        self.status = status
+        # 메모리에만 반영되고 아직 저장되지 않은 변경 수. 0이 아니면 비우지 않습니다.
+        self.dirty = 0
+        # status를 DB에서 마지막으로 확인한 시각
+        self.loaded_at = time.monotonic()
+
+
+async def _load_user_status(user_id: int) -> tuple[int, str, int] | None:
+    if write_behind.WRITE_BEHIND_ENABLED:
+        pending = message_writer.pending_user_status(user_id)
+        if pending is not None:
+            return pending
+    async with AsyncSessionLocal() as db:
+        user = await db.run_sync(crud.get_user, user_id=user_id)
+        if user is None:
+            return None
+        return user.experience_points, user.character_state, user.harmful_chat_count
+
+
+class UserStateCache:
+    """
+    사용자별 (경험치, 캐릭터 상태, 유해 채팅 수) 캐시.
+
+    같은 사용자의 변경은 사용자별 락으로 하나씩 적용되므로 동시에 온 메시지끼리 갱신을 잃지 않습니다.
+    write_through이면 DB에서 원자적으로 증감(GREATEST(xp + d, 0))하고 DB가 돌려준 값으로 캐시를 맞추며
+    (다른 워커의 변경도 여기서 반영됩니다), 아니면 메모리에만 반영하고 저장이 끝났을 때 settle로 알려줘야 합니다.
+    """
+
+    def __init__(self, max_users: int = USER_STATE_CACHE_SIZE, ttl: float = USER_STATE_CACHE_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._users: OrderedDict[int, _UserState] = OrderedDict()
+        self._locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def _lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    def _fresh(self, user_id: int) -> _UserState | None:
+        """
+        믿을 수 있는 항목. 저장 대기 중인 변경이 있으면 메모리 값이 최신이므로 TTL과 상관없이 씁니다.
+        """
+        entry = self._users.get(user_id)
+        if entry is not None and not entry.dirty and time.monotonic() - entry.loaded_at > self.ttl:
+            del self._users[user_id]
+            return None
+        return entry
+
+    def _store(self, user_id: int, entry: _UserState):
+        self._users[user_id] = entry
+        self._users.move_to_end(user_id)
+        if len(self._users) > self.max_users:
+            for candidate in [uid for uid, state in self._users.items() if not state.dirty]:
+                if len(self._users) <= self.max_users:
+                    break
+                del self._users[candidate]
+
+    async def get(self, user_id: int) -> tuple[int, str, int] | None:
+        entry = self._fresh(user_id)
+        if entry is not None:
+            self.hits += 1
+            self._users.move_to_end(user_id)
+            return entry.status
+        async with self._lock(user_id):
+            entry = self._fresh(user_id)
+            if entry is not None:
+                return entry.status
+            self.misses += 1
+            status = await _load_user_status(user_id)
+            if status is not None:
+                self._store(user_id, _UserState(status))
+            return status
+
+    def peek(self, user_id: int) -> tuple[int, str, int] | None:
+        """
+        캐시에 있는 상태만 돌려줍니다. DB는 읽지 않습니다.
+        """
+        entry = self._fresh(user_id)
+        return entry.status if entry is not None else None
+
+    async def apply(self, user_id: int, is_harmful: bool, write_through: bool = True,
+                    db=None) -> tuple[int, str, int] | None:
+        """
+        메시지 하나의 판정 결과를 사용자 상태에 반영하고 새 상태를 반환합니다. 사용자가 없으면 None.
+        db(AsyncSession)를 주면 write_through 갱신에 그 세션을 씁니다.
+        """
+        async with self._lock(user_id):
+            entry = self._fresh(user_id)
+            if entry is not None:
+                self.hits += 1
+
+            if write_through:
+                # 증감은 DB가 하므로 캐시에 없어도 미리 읽을 필요가 없습니다.
+                xp_delta, new_state, harmful_delta = status_delta(is_harmful)
+                increment = functools.partial(
+                    crud.increment_user_status,
+                    user_id=user_id, xp_delta=xp_delta, character_state=new_state, harmful_delta=harmful_delta,
+                )
+                if db is not None:
+                    status = await db.run_sync(increment)
+                else:
+                    async with AsyncSessionLocal() as session:
+                        status = await session.run_sync(increment)
+                if status is None:
+                    self._users.pop(user_id, None)
+                    return None
+                if entry is None:
+                    entry = _UserState(status)
+                else:
+                    entry.status = status
+                    entry.loaded_at = time.monotonic()
+            else:
+                if entry is None:
+                    self.misses += 1
+                    current = await _load_user_status(user_id)
+                    if current is None:
+                        return None
+                    entry = _UserState(current)
+                xp, _, harmful_chat_count = entry.status
+                entry.status = compute_user_status(xp, harmful_chat_count, is_harmful)
+                entry.dirty += 1
+
+            self._store(user_id, entry)
+            return entry.status
+
+    def settle(self, user_id: int, status: tuple[int, str, int] | None = None):
+        """
+        write_through=False로 적용한 변경 하나의 저장이 끝났음을 알립니다.
+        status는 저장 후 DB의 값이며, None이면 (저장 실패 등) 남은 변경이 없을 때 캐시를 비웁니다.
+        """
+        entry = self._users.get(user_id)
+        if entry is None:
+            return
+        entry.dirty = max(entry.dirty - 1, 0)
+        if entry.dirty == 0:
+            if status is None:
+                del self._users[user_id]
+            else:
+                entry.status = status
+                entry.loaded_at = time.monotonic()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "users": len(self._users),
+            "max_users": self.max_users,
+            "dirty_users": sum(1 for state in self._users.values() if state.dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+user_states = UserStateCache()
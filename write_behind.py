@@ -0,0 +1,235 @@
+import asyncio
+import datetime
+import os
+from urllib.parse import urlparse
+
+import crud
+import models
+import schemas
+from broadcast_backend import BROADCAST_URL
+from database import AsyncSessionLocal
+from scoring import status_delta
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "0") == "1"
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "20"))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500"))
+# 저장 대기 메시지가 이만큼 쌓이면 add_message가 자리가 날 때까지 기다립니다.
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "10000"))
+# buffered: 큐에 넣고 바로 반환 (브로드캐스트가 커밋을 기다리지 않음)
+# commit:   배치 커밋이 끝날 때까지 기다린 뒤 반환 (그룹 커밋)
+WRITE_BEHIND_DURABILITY = os.getenv("WRITE_BEHIND_DURABILITY", "buffered")
+WRITE_BEHIND_ID_BLOCK = int(os.getenv("WRITE_BEHIND_ID_BLOCK", "1000"))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "5"))
+
+
+def _compose(first: tuple[int, int, str, int], then: tuple[int, int, str, int]) -> tuple[int, int, str, int]:
+    """
+    사용자 상태 변경 두 개를 하나로 합칩니다. 변경은 (경험치 증감, 경험치 하한, 캐릭터 상태, 유해 채팅 수 증감)이며
+    경험치에 max(xp + 증감, 하한)으로 적용됩니다. max(max(x + a1, b1) + a2, b2) = max(x + a1 + a2, max(b1 + a2, b2))
+    """
+    xp_delta, xp_floor, _, harmful_delta = first
+    then_xp_delta, then_xp_floor, character_state, then_harmful_delta = then
+    return (
+        xp_delta + then_xp_delta,
+        max(xp_floor + then_xp_delta, then_xp_floor),
+        character_state,
+        harmful_delta + then_harmful_delta,
+    )
+
+
+class WriteBehindBuffer:
+    """
+    새 메시지와 사용자 상태 변경을 모아 일정 주기/개수마다 한 트랜잭션으로 저장합니다.
+
+    메시지 id는 DB에서 미리 예약한 구간에서, created_at은 애플리케이션에서 부여하므로
+    저장 전에도 완전한 메시지를 브로드캐스트할 수 있습니다.
+
+    id 구간은 프로세스마다 따로 예약하므로 워커가 여럿이면 id가 시간 순서대로 늘지 않습니다.
+    (after_id 커서, 최근 메시지 버퍼, 보관 계층이 모두 이 순서에 기댑니다) 그래서 단일 워커에서만 씁니다.
+    사용자 상태는 절대값이 아니라 증감으로 저장하므로 다른 경로의 변경을 덮어쓰지 않습니다.
+    """
+
+    def __init__(self, flush_ms: float = WRITE_BEHIND_FLUSH_MS, max_batch: int = WRITE_BEHIND_MAX_BATCH,
+                 max_pending: int = WRITE_BEHIND_MAX_PENDING, durability: str = WRITE_BEHIND_DURABILITY,
+                 id_block: int = WRITE_BEHIND_ID_BLOCK):
+        if durability not in ("buffered", "commit"):
+            raise ValueError(f"Unknown write-behind durability: {durability}")
+        self.flush_interval = flush_ms / 1000
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.durability = durability
+        self.id_block = id_block
+        self._messages: list[dict] = []
+        # 아직 저장되지 않은 최신 상태(조회용)와, 저장할 상태 변경(증감)
+        self._user_statuses: dict[int, tuple[int, str, int]] = {}
+        self._flushing_user_statuses: dict[int, tuple[int, str, int]] = {}
+        self._user_changes: dict[int, tuple[int, int, str, int]] = {}
+        self._waiters: list[asyncio.Future] = []
+        self._next_id = 0
+        self._last_id = -1
+        self._id_lock: asyncio.Lock | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._space: asyncio.Condition | None = None
+        self._worker: asyncio.Task | None = None
+        self._closing = False
+        self.flushes = 0
+        self.messages_written = 0
+        self.failed_flushes = 0
+
+    async def start(self):
+        """
+        여러 워커 설정(BROADCAST_URL이 memory://가 아님)이면 시작하지 않습니다.
+        """
+        if WRITE_BEHIND_ENABLED and urlparse(BROADCAST_URL).scheme != "memory":
+            raise RuntimeError(
+                "WRITE_BEHIND_ENABLED=1 needs a single worker (BROADCAST_URL=memory://): "
+                "per-process id blocks would break message id ordering across workers"
+            )
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._id_lock = self._id_lock or asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._space = asyncio.Condition()
+            self._worker = asyncio.create_task(self._run())
+
+    async def _allocate_id(self) -> int:
+        async with self._id_lock:
+            if self._next_id > self._last_id:
+                async with AsyncSessionLocal() as db:
+                    start = await db.run_sync(
+                        crud.reserve_ids, "messages", models.Message.__table__, self.id_block
+                    )
+                self._next_id, self._last_id = start, start + self.id_block - 1
+            message_id = self._next_id
+            self._next_id += 1
+            return message_id
+
+    def pending_user_status(self, user_id: int) -> tuple[int, str, int] | None:
+        """
+        아직 DB에 반영되지 않은 사용자 상태. DB보다 이 값이 최신입니다.
+        """
+        status = self._user_statuses.get(user_id)
+        if status is None:
+            status = self._flushing_user_statuses.get(user_id)
+        return status
+
+    async def add_message(self, message_create: schemas.MessageCreate,
+                          user_status: tuple[int, str, int] | None = None) -> schemas.Message:
+        """
+        메시지에 id/created_at을 부여해 저장 대기열에 넣고, 완성된 메시지를 반환합니다.
+        """
+        self._ensure_worker()
+        async with self._space:
+            await self._space.wait_for(lambda: len(self._messages) < self.max_pending)
+
+        row = message_create.model_dump()
+        row["id"] = await self._allocate_id()
+        row["created_at"] = row.get("created_at") or datetime.datetime.utcnow()
+        self._messages.append(row)
+        if user_status is not None:
+            user_id = message_create.owner_id
+            self._user_statuses[user_id] = user_status
+            xp_delta, character_state, harmful_delta = status_delta(message_create.is_harmful)
+            change = (xp_delta, 0, character_state, harmful_delta)
+            if user_id in self._user_changes:
+                change = _compose(self._user_changes[user_id], change)
+            self._user_changes[user_id] = change
+        if len(self._messages) >= self.max_batch:
+            self._wakeup.set()
+
+        if self.durability == "commit":
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            self._wakeup.set()
+            await waiter
+        return schemas.Message(**row)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """
+        쌓인 메시지와 사용자 상태를 한 트랜잭션으로 저장합니다.
+        """
+        while self._messages or self._user_changes:
+            messages = self._messages[:self.max_batch]
+            del self._messages[:self.max_batch]
+            self._flushing_user_statuses = self._user_statuses
+            self._user_statuses = {}
+            user_changes, self._user_changes = self._user_changes, {}
+            waiters, self._waiters = self._waiters, []
+            async with self._space:
+                self._space.notify_all()
+
+            error = await self._write(messages, user_changes)
+            if error is None:
+                self.flushes += 1
+                self.messages_written += len(messages)
+            else:
+                self.failed_flushes += 1
+                # 실패한 상태 변경은 그 뒤에 들어온 변경 앞에 다시 붙여 둡니다.
+                for user_id, status in self._flushing_user_statuses.items():
+                    self._user_statuses.setdefault(user_id, status)
+                for user_id, change in user_changes.items():
+                    if user_id in self._user_changes:
+                        change = _compose(change, self._user_changes[user_id])
+                    self._user_changes[user_id] = change
+            self._flushing_user_statuses = {}
+            for waiter in waiters:
+                if not waiter.done():
+                    if error is None:
+                        waiter.set_result(None)
+                    else:
+                        waiter.set_exception(error)
+            if error is not None:
+                return
+
+    async def _write(self, messages: list[dict], user_changes: dict) -> Exception | None:
+        for attempt in range(WRITE_BEHIND_MAX_RETRIES):
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.run_sync(crud.apply_user_status_changes, user_changes)
+                    await db.run_sync(crud.insert_messages, messages)
+                    await db.commit()
+                return None
+            except Exception as e:
+                print(f"Write-behind flush failed (attempt {attempt + 1}): {e}")
+                last_error = e
+                await asyncio.sleep(min(0.05 * 2 ** attempt, 2))
+        print(f"Dropping {len(messages)} messages after {WRITE_BEHIND_MAX_RETRIES} failed flushes")
+        return last_error
+
+    async def close(self):
+        """
+        남은 변경을 모두 저장하고 워커를 멈춥니다. (앱 종료 시)
+        """
+        if self._worker is not None:
+            # 쓰는 도중에 취소하면 이미 꺼낸 배치를 잃으므로, 멈추라고 알리고 진행 중인 저장이 끝나길 기다립니다.
+            self._closing = True
+            self._wakeup.set()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+            self._closing = False
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": WRITE_BEHIND_ENABLED,
+            "durability": self.durability,
+            "pending_messages": len(self._messages),
+            "pending_user_updates": len(self._user_changes),
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "messages_written": self.messages_written,
+            "avg_batch_size": self.messages_written / self.flushes if self.flushes else 0.0,
+        }
+
+
+message_writer = WriteBehindBuffer()